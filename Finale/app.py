@@ -1,11 +1,30 @@
+import csv
+import hashlib
+import hmac
+import heapq
+import io
+import base64
+import json
+import math
 import os
+import queue
+import secrets
+import uuid
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, date, timedelta, timezone
 from functools import wraps
 
-from flask import Flask, jsonify, request, render_template, session, redirect, url_for
+import click
+from flask import Flask, jsonify, request, render_template, session, redirect, url_for, stream_with_context
+from itsdangerous import BadSignature, URLSafeSerializer
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, Date, desc, asc
-from sqlalchemy.orm import Session # Import Session for modern ORM access
+from markupsafe import escape
+from sqlalchemy import case, event, func, Date
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, attributes, validates # Import Session for modern ORM access
 
 # --- FLASK CONFIGURATION ---
 app = Flask(__name__)
@@ -15,18 +34,62 @@ DB_PATH = os.path.join(BASE_DIR, 'unisphere.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'a_very_secret_key_for_unisphere' 
+# Auth decorators cache (exists, is_admin) per user id for this long / this many users
+app.config['PRINCIPAL_CACHE_TTL'] = 60
+app.config['PRINCIPAL_CACHE_SIZE'] = 10000
+# Reminders go out this long before a test is due / an appointment starts
+app.config['REMINDER_LEAD_TIMES'] = [timedelta(days=1), timedelta(hours=1)]
+app.config['REMINDER_BATCH_SIZE'] = 500
+# Multi-process servers should leave this on in exactly one worker, or reminders go out once per worker
+app.config['REMINDER_SCHEDULER_ENABLED'] = True
+# How often the scheduler reads ReminderMarker to notice tests/appointments written by other processes
+app.config['REMINDER_MARKER_CHECK_INTERVAL'] = timedelta(seconds=30)
 
 db = SQLAlchemy(app)
 
 # --- DATABASE MODELS ---
 
+def normalize_username(username):
+    """Sort/search key for usernames: Unicode case folding, so 'Ørjan' matches 'ø'."""
+    return username.strip().casefold()
+
+def prefix_range(column, prefix):
+    """Conditions matching exactly the values of column that start with prefix, as one index range scan.
+
+    SQLite compares UTF-8 bytes, which sort like code points, so the upper bound is
+    prefix with its last character incremented (skipping surrogates, which UTF-8 can't
+    encode). A fixed sentinel such as U+FFFF would miss keys continuing outside the BMP.
+    """
+    stem = prefix
+    while stem:
+        code = ord(stem[-1]) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            code = 0xE000
+        if code <= 0x10FFFF:
+            return (column >= prefix, column < stem[:-1] + chr(code))
+        stem = stem[:-1]
+    return (column >= prefix,)
+
+class SyncTracked:
+    """Mixin for per-user rows that /api/sync hands out as deltas.
+
+    version/updated_at are stamped by track_sync_changes() on every flush.
+    """
+    updated_at = db.Column(db.DateTime, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 class User(db.Model):
     """Represents a student or an admin."""
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
+    # Case-folded in Python by validate_username(); SQLite's lower() only folds ASCII
+    username_key = db.Column(db.String(80), nullable=False)
     password_hash = db.Column(db.String(120), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
     gpa = db.Column(db.Float, default=0.0) 
+    # Running GPA totals, kept in step with Course writes by apply_course_to_gpa()
+    quality_points = db.Column(db.Float, nullable=False, default=0.0)
+    total_credits = db.Column(db.Float, nullable=False, default=0.0)
     
     # Relationships
     appointments = db.relationship('Appointment', backref='student', lazy=True)
@@ -45,33 +108,80 @@ class User(db.Model):
     sent_messages = db.relationship('DirectMessage', foreign_keys='DirectMessage.sender_id', backref='sender', lazy=True)
     received_messages = db.relationship('DirectMessage', foreign_keys='DirectMessage.receiver_id', backref='receiver', lazy=True)
 
+    # Case-insensitive prefix search in the user directory is a range scan on this index
+    __table_args__ = (
+        db.Index('ix_user_username_key', 'username_key', 'id'),
+        db.Index('ix_user_gpa_id', 'gpa', 'id'), # admin user list sorted by GPA
+        # Purged ids are never handed out again, so old sessions and feed URLs can't reach a new account
+        {'sqlite_autoincrement': True},
+    )
+
+    @validates('username')
+    def validate_username(self, key, value):
+        self.username_key = normalize_username(value)
+        return value
 
     def __repr__(self):
         return f'<User {self.username}>'
 
-class Course(db.Model):
+class CourseCatalog(db.Model):
+    """One row per distinct course title; Course, TimetableEntry and Test point here by catalog_id."""
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(100), nullable=False) # display form, as first entered
+    normalized = db.Column(db.String(100), nullable=False, unique=True) # normalize_course_title(title)
+
+    def to_dict(self):
+        return {'id': self.id, 'title': self.title}
+
+def catalog_title_property():
+    """A course title stored only in the catalog; assigned titles get their catalog_id in assign_catalog_ids()."""
+    def get_title(self):
+        if '_pending_title' in self.__dict__:
+            return self._pending_title
+        return self.catalog.title if self.catalog else None
+
+    def set_title(self, value):
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError('Course title must be a non-empty string')
+        self._pending_title = value.strip()
+        self.catalog_id = None # marks the row dirty so the flush hook sees it
+
+    def title_expression(cls):
+        return db.select(CourseCatalog.title).where(CourseCatalog.id == cls.catalog_id).scalar_subquery()
+
+    return hybrid_property(get_title, set_title, expr=title_expression)
+
+class Course(SyncTracked, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    title = db.Column(db.String(100), nullable=False)
     score = db.Column(db.Integer, default=0)
     credits = db.Column(db.Float, default=3.0)
+    catalog_id = db.Column(db.Integer, db.ForeignKey('course_catalog.id'), nullable=False, index=True)
+    catalog = db.relationship(CourseCatalog, lazy='joined')
+    title = catalog_title_property()
     
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
+            'catalog_id': self.catalog_id,
             'title': self.title,
             'score': self.score,
             'credits': self.credits,
         }
 
-class Appointment(db.Model):
+class Appointment(SyncTracked, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     type = db.Column(db.String(50), nullable=False)
     date_time = db.Column(db.DateTime, nullable=False)
     details = db.Column(db.Text, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_appointment_user_date_time', 'user_id', 'date_time'),
+        db.Index('ix_appointment_date_time', 'date_time'), # reminder scheduler window scans
+    )
+
     def to_dict(self):
         # Format the datetime for easier frontend use (though FE handles isoformat too)
         return {
@@ -88,6 +198,8 @@ class HydrationEntry(db.Model):
     amount_ml = db.Column(db.Integer, nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc)) 
 
+    __table_args__ = (db.Index('ix_hydration_entry_user_timestamp', 'user_id', 'timestamp'),)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -95,12 +207,26 @@ class HydrationEntry(db.Model):
             'timestamp': self.timestamp.isoformat(),
         }
 
-class MoodEntry(db.Model): 
+class HydrationDaily(db.Model):
+    """Per-user daily hydration total, maintained alongside every HydrationEntry insert."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(Date, primary_key=True)
+    total_ml = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'total_ml': self.total_ml,
+        }
+
+class MoodEntry(SyncTracked, db.Model): 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     mood_score = db.Column(db.Integer, nullable=False)
     entry_date = db.Column(Date, default=date.today, nullable=False) # Date portion for history chart
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc)) # Full timestamp for click logging
+
+    __table_args__ = (db.Index('ix_mood_entry_user_timestamp', 'user_id', 'timestamp'),)
     
     def to_dict(self):
         return {
@@ -110,7 +236,7 @@ class MoodEntry(db.Model):
             'timestamp': self.timestamp.isoformat(),
         }
 
-class FinancialEntry(db.Model):
+class FinancialEntry(SyncTracked, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category = db.Column(db.String(50), nullable=False)
@@ -128,13 +254,15 @@ class FinancialEntry(db.Model):
             'month_year': self.month_year
         }
 
-class Notification(db.Model): 
+class Notification(SyncTracked, db.Model): 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.String(255), nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc)) 
     is_read = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (db.Index('ix_notification_user_timestamp', 'user_id', 'timestamp'),)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -143,19 +271,79 @@ class Notification(db.Model):
             'is_read': self.is_read
         }
 
-class TimetableEntry(db.Model):
+# NEW: Announcements are stored once; each user only keeps a read cursor into them
+class Broadcast(db.Model):
+    """An announcement shown to every user alongside their personal notifications."""
+    id = db.Column(db.Integer, primary_key=True)
+    message = db.Column(db.String(255), nullable=False)
+    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+
+    def to_dict(self, is_read=False):
+        return {
+            'id': self.id,
+            'message': self.message,
+            'timestamp': self.timestamp.isoformat(),
+            'is_read': is_read,
+            'broadcast': True
+        }
+
+class BroadcastCursor(db.Model):
+    """Highest Broadcast.id the user has read; every broadcast above it is unread."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_seen_id = db.Column(db.Integer, nullable=False, default=0)
+
+DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+def clock_to_minutes(value):
+    """'09:30' -> 570; raises ValueError for anything that is not a valid HH:MM string."""
+    if not isinstance(value, str):
+        raise ValueError(f'Expected an HH:MM string, got {type(value).__name__}')
+    parsed = datetime.strptime(value.strip(), '%H:%M')
+    return parsed.hour * 60 + parsed.minute
+
+def minutes_to_clock(minutes):
+    return '24:00' if minutes >= 24 * 60 else f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+class TimetableEntry(SyncTracked, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    course_title = db.Column(db.String(100), nullable=False)
     day_of_week = db.Column(db.String(10), nullable=False) # e.g., 'Monday', 'Tuesday'
     start_time = db.Column(db.String(5), nullable=False) # e.g., '09:00'
     end_time = db.Column(db.String(5), nullable=False)   # e.g., '10:30'
     location = db.Column(db.String(100), nullable=True)
+    catalog_id = db.Column(db.Integer, db.ForeignKey('course_catalog.id'), nullable=False, index=True)
+    catalog = db.relationship(CourseCatalog, lazy='joined')
+    course_title = catalog_title_property()
+    # Normalized copies of the strings above (0 = Monday, minutes since midnight), kept in step by the validators
+    day_index = db.Column(db.Integer, nullable=True)
+    start_minute = db.Column(db.Integer, nullable=True)
+    end_minute = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_timetable_entry_user_day_start', 'user_id', 'day_index', 'start_minute'),
+        db.Index('ix_timetable_entry_day_start', 'day_index', 'start_minute'), # admin view across all users
+    )
+
+    @validates('day_of_week')
+    def validate_day_of_week(self, key, value):
+        if not isinstance(value, str):
+            raise ValueError(f'Expected a day name, got {type(value).__name__}')
+        day = value.strip().capitalize()
+        self.day_index = DAYS_OF_WEEK.index(day) # ValueError for unknown days
+        return day
+
+    @validates('start_time', 'end_time')
+    def validate_time(self, key, value):
+        minutes = clock_to_minutes(value)
+        setattr(self, 'start_minute' if key == 'start_time' else 'end_minute', minutes)
+        return minutes_to_clock(minutes)
 
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
+            'catalog_id': self.catalog_id,
             'course_title': self.course_title,
             'day_of_week': self.day_of_week,
             'start_time': self.start_time,
@@ -163,25 +351,33 @@ class TimetableEntry(db.Model):
             'location': self.location,
         }
 
-class Test(db.Model):
+class Test(SyncTracked, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    course_title = db.Column(db.String(100), nullable=False)
     type = db.Column(db.String(50), nullable=False) # e.g., 'Midterm', 'Assignment'
     due_date = db.Column(db.DateTime, nullable=False)
     details = db.Column(db.Text, nullable=True)
+    catalog_id = db.Column(db.Integer, db.ForeignKey('course_catalog.id'), nullable=False, index=True)
+    catalog = db.relationship(CourseCatalog, lazy='joined')
+    course_title = catalog_title_property()
+
+    __table_args__ = (
+        db.Index('ix_test_user_due_date', 'user_id', 'due_date'),
+        db.Index('ix_test_due_date', 'due_date'), # reminder scheduler window scans
+    )
 
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
+            'catalog_id': self.catalog_id,
             'course_title': self.course_title,
             'type': self.type,
             'due_date': self.due_date.isoformat(),
             'details': self.details,
         }
 
-class StudySession(db.Model):
+class StudySession(SyncTracked, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     topic = db.Column(db.String(100), nullable=True)
@@ -189,6 +385,8 @@ class StudySession(db.Model):
     start_time = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     end_time = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (db.Index('ix_study_session_user_start_time', 'user_id', 'start_time'),)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -205,18 +403,24 @@ class CommunityPost(db.Model):
     title = db.Column(db.String(255), nullable=False)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Denormalized; bumped in the same transaction as each comment insert
+    comment_count = db.Column(db.Integer, nullable=False, default=0)
     
     comments = db.relationship('CommunityComment', backref='post', lazy=True)
 
-    def to_dict(self):
+    # Backs the keyset-paginated feed (newest first)
+    __table_args__ = (db.Index('ix_community_post_timestamp_id', 'timestamp', 'id'),)
+
+    def to_dict(self, username=None):
+        # Pass username when it was already fetched with a join to skip the lazy author load
         return {
             'id': self.id,
             'user_id': self.user_id,
-            'username': self.author.username,
+            'username': username if username is not None else self.author.username,
             'title': self.title,
             'content': self.content,
             'timestamp': self.timestamp.isoformat(),
-            'comment_count': len(self.comments)
+            'comment_count': self.comment_count
         }
 
 class CommunityComment(db.Model):
@@ -243,67 +447,857 @@ class DirectMessage(db.Model):
     content_encrypted = db.Column(db.Text, nullable=False) # Simulated E2EE: Stores encrypted message
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
-    def to_dict(self):
+    # Serves "messages in this direction after id N" as a range scan
+    __table_args__ = (db.Index('ix_direct_message_pair_id', 'sender_id', 'receiver_id', 'id'),)
+
+    def to_dict(self, sender_username=None):
         return {
             'id': self.id,
             'sender_id': self.sender_id,
-            'sender_username': self.sender.username,
+            'receiver_id': self.receiver_id,
+            'sender_username': sender_username if sender_username is not None else self.sender.username,
             'content_encrypted': self.content_encrypted,
             'timestamp': self.timestamp.isoformat()
         }
+
+class ConversationSummary(db.Model):
+    """One row per (user, peer) conversation: last message, read cursor and unread count.
+
+    Maintained by maintain_conversation_summaries() on every DirectMessage insert.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    peer_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('direct_message.id'), nullable=False)
+    last_message_at = db.Column(db.DateTime, nullable=False)
+    last_read_id = db.Column(db.Integer, nullable=False, default=0)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.Index('ix_conversation_summary_user_last', 'user_id', 'last_message_at'),)
 # END NEW COMMUNITY MODELS
 
+# NEW: Delta-sync bookkeeping
+class SyncState(db.Model):
+    """Per-user change counter; /api/sync cursors are values of this counter."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ReminderMarker(db.Model):
+    """Single-row counter bumped when tests/appointments change in a process without a running
+    reminder scheduler, so the scheduler elsewhere knows to rescan its window."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class SyncTombstone(db.Model):
+    """Remembers deleted SyncTracked rows so clients can drop them locally."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    table_name = db.Column(db.String(30), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (db.Index('ix_sync_tombstone_user_version', 'user_id', 'version'),)
+
+# NEW: Calendar feed state, kept apart from SyncState so mood, finance or notification
+# writes don't invalidate calendar apps' ETags
+class CalendarFeed(db.Model):
+    """Per-user ETag version of /api/calendar.ics and the secret its feed tokens must carry."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0) # moves on timetable/test/appointment writes
+    # Random, so a URL never outlives its row: a purged user's id handed out again gets a new secret
+    token_secret = db.Column(db.String(64), nullable=True) # replaced to revoke feed URLs
+
+# Sync payload key -> model. Each gets a (user_id, version) index for the delta scans.
+SYNC_MODELS = {
+    'courses': Course,
+    'timetable': TimetableEntry,
+    'tests': Test,
+    'appointments': Appointment,
+    'notifications': Notification,
+    'finance': FinancialEntry,
+    'study_sessions': StudySession,
+    'mood_entries': MoodEntry,
+}
+SYNC_TABLE_NAMES = {model: name for name, model in SYNC_MODELS.items()}
+for _model in SYNC_MODELS.values():
+    db.Index(f'ix_{_model.__tablename__}_user_version', _model.user_id, _model.version)
+
+def bump_sync_version(session_obj, user_id):
+    """Atomically increments and returns the user's change counter."""
+    stmt = sqlite_insert(SyncState).values(user_id=user_id, version=1).on_conflict_do_update(
+        index_elements=[SyncState.user_id],
+        set_={'version': SyncState.version + 1}
+    ).returning(SyncState.version)
+    return session_obj.connection().execute(stmt).scalar_one()
+
+def bump_sync_versions(session_obj, user_ids):
+    """bump_sync_version() for many users at once: one executemany upsert, one read back."""
+    conn = session_obj.connection()
+    stmt = sqlite_insert(SyncState).on_conflict_do_update(
+        index_elements=[SyncState.user_id],
+        set_={'version': SyncState.version + 1}
+    )
+    conn.execute(stmt, [{'user_id': user_id, 'version': 1} for user_id in user_ids])
+    return dict(conn.execute(db.select(SyncState.user_id, SyncState.version).where(SyncState.user_id.in_(list(user_ids)))).all())
+
+def bump_all_sync_versions(session_obj):
+    """bump_sync_version() for every user in one INSERT ... SELECT, for CLI jobs that rewrite everyone's data."""
+    session_obj.execute(sqlite_insert(SyncState).from_select(
+        ['user_id', 'version'], db.select(User.id, db.literal(1)).where(db.true()) # WHERE keeps SQLite from reading ON CONFLICT as a join
+    ).on_conflict_do_update(index_elements=[SyncState.user_id], set_={'version': SyncState.version + 1}))
+
+@event.listens_for(Session, 'before_flush')
+def track_sync_changes(session_obj, flush_context, instances):
+    """Stamps version/updated_at on changed SyncTracked rows and records tombstones for deletes."""
+    now = datetime.now(timezone.utc)
+    versions = {}
+
+    def next_version(user_id):
+        user_id = int(user_id)
+        if user_id not in versions:
+            versions[user_id] = bump_sync_version(session_obj, user_id)
+        return versions[user_id]
+
+    changed = list(session_obj.new) + [obj for obj in session_obj.dirty if session_obj.is_modified(obj)]
+    for obj in changed:
+        if isinstance(obj, SyncTracked) and obj.user_id is not None:
+            obj.version = next_version(obj.user_id)
+            obj.updated_at = now
+
+    for obj in list(session_obj.deleted):
+        if isinstance(obj, SyncTracked):
+            session_obj.add(SyncTombstone(
+                user_id=obj.user_id,
+                table_name=SYNC_TABLE_NAMES[type(obj)],
+                row_id=obj.id,
+                version=next_version(obj.user_id),
+                deleted_at=now
+            ))
+
+CALENDAR_MODELS = (TimetableEntry, Test, Appointment)
+
+def bump_calendar_versions(session_obj, user_ids):
+    """Moves the calendar ETag of every given user; call in the transaction that changes their schedule."""
+    stmt = sqlite_insert(CalendarFeed).on_conflict_do_update(
+        index_elements=[CalendarFeed.user_id], set_={'version': CalendarFeed.version + 1}
+    )
+    session_obj.connection().execute(stmt, [{'user_id': user_id, 'version': 1} for user_id in user_ids])
+
+@event.listens_for(Session, 'before_flush')
+def track_calendar_changes(session_obj, flush_context, instances):
+    changed = list(session_obj.new) + list(session_obj.deleted) + [obj for obj in session_obj.dirty if session_obj.is_modified(obj)]
+    user_ids = {int(obj.user_id) for obj in changed if isinstance(obj, CALENDAR_MODELS) and obj.user_id is not None}
+    if user_ids:
+        bump_calendar_versions(session_obj, user_ids)
+
+# NEW: Course catalog. Courses, timetable entries and tests store only the integer
+# catalog_id; their title attributes read through to the catalog row.
+CATALOG_MODELS = (Course, TimetableEntry, Test)
+_catalog_ids = {} # normalized title -> id of committed catalog rows (they are never deleted)
+
+def normalize_course_title(title):
+    # FIX: casefold in Python for every caller, migrations included; SQLite's lower() is ASCII-only
+    return title.strip().casefold()
+
+def resolve_catalog_ids(session_obj, titles):
+    """Returns {normalized title: catalog id} for the given titles, creating missing catalog rows."""
+    wanted = {normalize_course_title(title): title.strip() for title in titles if title and title.strip()}
+    # Ids looked up in this transaction only reach the shared cache once it commits
+    staged = session_obj.info.setdefault('catalog_ids', {})
+    missing = [normalized for normalized in wanted if normalized not in _catalog_ids and normalized not in staged]
+    if missing:
+        conn = session_obj.connection()
+        conn.execute(sqlite_insert(CourseCatalog).on_conflict_do_nothing(index_elements=[CourseCatalog.normalized]),
+                     [{'title': wanted[normalized], 'normalized': normalized} for normalized in missing])
+        staged.update(conn.execute(db.select(CourseCatalog.normalized, CourseCatalog.id).where(CourseCatalog.normalized.in_(missing))).all())
+    return {normalized: _catalog_ids.get(normalized) or staged[normalized] for normalized in wanted}
+
+@event.listens_for(Session, 'after_commit')
+def publish_catalog_ids(session_obj):
+    _catalog_ids.update(session_obj.info.pop('catalog_ids', {}))
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_catalog_ids(session_obj, previous_transaction):
+    session_obj.info.pop('catalog_ids', None)
+
+@event.listens_for(Session, 'before_flush')
+def assign_catalog_ids(session_obj, flush_context, instances):
+    """Points new and retitled courses, timetable entries and tests at their catalog row."""
+    pending = [obj for obj in list(session_obj.new) + list(session_obj.dirty)
+               if isinstance(obj, CATALOG_MODELS) and '_pending_title' in obj.__dict__]
+    if pending:
+        ids = resolve_catalog_ids(session_obj, [obj._pending_title for obj in pending])
+        for obj in pending:
+            obj.catalog_id = ids[normalize_course_title(obj.__dict__.pop('_pending_title'))]
+            if attributes.instance_state(obj).persistent:
+                session_obj.expire(obj, ['catalog']) # reload the retitled row's catalog on next access
+
 # --- HELPER FUNCTIONS & DECORATORS ---
 
-def calculate_gpa(user_id):
-    """Calculates and updates the user's GPA based on current courses."""
-    with Session(db.engine) as session_obj:
-        user = session_obj.get(User, user_id)
-        if not user:
-            return 0.0
+# Standard 4.0 scale conversion (A=4, B=3, C=2, D=1, F=0)
+GRADE_SCALE = [(90, 4.0), (80, 3.0), (70, 2.0), (60, 1.0)]
+
+def score_to_gpa_point(score):
+    for min_score, gpa_point in GRADE_SCALE:
+        if score >= min_score:
+            return gpa_point
+    return 0.0
+
+def gpa_point_expr(score_column):
+    """SQL twin of score_to_gpa_point() for set-based recomputation."""
+    return case(*[(score_column >= min_score, gpa_point) for min_score, gpa_point in GRADE_SCALE], else_=0.0)
+
+def gpa_expr(quality_points, credits):
+    # Guard against float residue left behind after adding and removing courses
+    return case((credits > 0.0001, func.round(quality_points / credits, 2)), else_=0.0)
+
+def apply_course_to_gpa(user_id, score, credits, sign=1):
+    """Adds (sign=1) or removes (sign=-1) one course from the user's running GPA totals.
+
+    Runs in the caller's transaction so it commits together with the course write.
+    """
+    points = score_to_gpa_point(score or 0) * credits * sign
+    credits = credits * sign
+    db.session.execute(db.update(User).where(User.id == user_id).values(
+        quality_points=User.quality_points + points,
+        total_credits=User.total_credits + credits,
+        gpa=gpa_expr(User.quality_points + points, User.total_credits + credits)
+    ))
+
+def gpa_recalculation_stmt(user_id=None):
+    """UPDATE that rebuilds GPA totals from Course rows; every user when user_id is None."""
+    quality_points = db.select(
+        func.coalesce(func.sum(gpa_point_expr(Course.score) * Course.credits), 0.0)
+    ).where(Course.user_id == User.id).scalar_subquery()
+    credits = db.select(func.coalesce(func.sum(Course.credits), 0.0)).where(Course.user_id == User.id).scalar_subquery()
+
+    stmt = db.update(User).values(
+        quality_points=quality_points,
+        total_credits=credits,
+        gpa=gpa_expr(quality_points, credits)
+    )
+    if user_id is not None:
+        stmt = stmt.where(User.id == user_id)
+    return stmt
 
-        courses = Course.query.filter_by(user_id=user_id).all()
-            
-        total_quality_points = 0.0
-        total_credits = 0.0
-
-        def score_to_gpa_point(score):
-            # Standard 4.0 scale conversion (A=4, B=3, C=2, D=1, F=0)
-            if score >= 90: return 4.0
-            if score >= 80: return 3.0
-            if score >= 70: return 2.0
-            if score >= 60: return 1.0
-            return 0.0
-
-        for course in courses:
-            gpa_point = score_to_gpa_point(course.score)
-            total_quality_points += gpa_point * course.credits
-            total_credits += course.credits
-
-        if total_credits == 0:
-            user.gpa = 0.0
-        else:
-            gpa = total_quality_points / total_credits
-            user.gpa = round(gpa, 2)
-            
-        session_obj.commit()
-        return user.gpa
+def calculate_gpa(user_id=None):
+    """Rebuilds GPA totals from Course rows in one set-based UPDATE (all users when user_id is None)."""
+    db.session.execute(gpa_recalculation_stmt(user_id))
+    db.session.commit()
+
+    if user_id is not None:
+        return db.session.query(User.gpa).filter(User.id == user_id).scalar() or 0.0
+
+@app.cli.command('recalculate-gpa')
+def recalculate_gpa_command():
+    """Recomputes every user's GPA from their courses (e.g. after a grading-scale change)."""
+    db.session.execute(gpa_recalculation_stmt())
+    # FIX: invalidate_dashboard() only reaches this CLI process; bumping the persisted
+    # counters is what makes a running server drop its cached dashboards.
+    bump_all_sync_versions(db.session)
+    db.session.commit()
+    print("GPA recalculated for all users.")
+
+
+def bump_comment_count(post_id, by=1):
+    """Keeps CommunityPost.comment_count in step; call in the same transaction as the comment insert."""
+    db.session.execute(
+        db.update(CommunityPost).where(CommunityPost.id == post_id).values(comment_count=CommunityPost.comment_count + by)
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def maintain_conversation_summaries(session_obj, flush_context):
+    """Upserts both participants' ConversationSummary rows for every new DirectMessage."""
+    conn = None
+    for obj in session_obj.new:
+        if not isinstance(obj, DirectMessage):
+            continue
+        conn = conn or session_obj.connection()
+        sides = [(obj.sender_id, obj.receiver_id, 0)]
+        if obj.receiver_id != obj.sender_id:
+            sides.append((obj.receiver_id, obj.sender_id, 1))
+        for owner_id, peer_id, incoming in sides:
+            conn.execute(sqlite_insert(ConversationSummary).values(
+                user_id=owner_id, peer_id=peer_id,
+                last_message_id=obj.id, last_message_at=obj.timestamp,
+                last_read_id=0, unread_count=incoming
+            ).on_conflict_do_update(
+                index_elements=[ConversationSummary.user_id, ConversationSummary.peer_id],
+                set_={
+                    'last_message_id': func.max(ConversationSummary.last_message_id, obj.id),
+                    'last_message_at': func.max(ConversationSummary.last_message_at, obj.timestamp),
+                    'unread_count': ConversationSummary.unread_count + incoming,
+                }
+            ))
+
+def mark_conversation_read(user_id, peer_id, up_to_id):
+    """Moves the user's read cursor for a conversation forward and recounts what is still unread.
+
+    up_to_id may come from the client, so the cursor never passes the conversation's last message.
+    """
+    read_id = func.min(func.max(ConversationSummary.last_read_id, up_to_id), ConversationSummary.last_message_id)
+    still_unread = db.select(func.count(DirectMessage.id)).where(
+        DirectMessage.sender_id == peer_id,
+        DirectMessage.receiver_id == user_id,
+        DirectMessage.id > read_id
+    ).scalar_subquery()
+    db.session.execute(db.update(ConversationSummary).where(
+        ConversationSummary.user_id == user_id,
+        ConversationSummary.peer_id == peer_id
+    ).values(last_read_id=read_id, unread_count=still_unread))
+    db.session.commit()
+
+
+# --- DASHBOARD SNAPSHOT CACHE ---
+# Each user's /api/dashboard sections are kept in memory and served with an ETag.
+# Mutating endpoints call invalidate_dashboard() for every user they touch; the
+# per-user data version stops a slow rebuild from storing a stale snapshot.
+# FIX: The version also carries the persisted SyncState counter, so writes made by
+# another process (CLI commands, a second worker) invalidate this cache too.
+_dashboard_cache = {}    # user_id -> {section_name: {'value', 'expires_at', 'version'}}
+_data_versions = {}      # user_id -> int, bumped on every write in this process
+_dashboard_lock = threading.Lock()
+
+def record_hydration(user_id, amount_ml, timestamp):
+    """Bumps the (user_id, day) rollup in the caller's transaction; returns the new daily total."""
+    stmt = sqlite_insert(HydrationDaily).values(user_id=user_id, day=timestamp.date(), total_ml=amount_ml).on_conflict_do_update(
+        index_elements=[HydrationDaily.user_id, HydrationDaily.day],
+        set_={'total_ml': HydrationDaily.total_ml + amount_ml}
+    ).returning(HydrationDaily.total_ml)
+    return db.session.execute(stmt).scalar_one()
+
+def rebuild_hydration_rollup():
+    """Recomputes HydrationDaily from every HydrationEntry in one set-based pass."""
+    db.session.query(HydrationDaily).delete()
+    db.session.execute(HydrationDaily.__table__.insert().from_select(
+        ['user_id', 'day', 'total_ml'],
+        db.select(
+            HydrationEntry.user_id,
+            func.date(HydrationEntry.timestamp),
+            func.sum(HydrationEntry.amount_ml)
+        ).group_by(HydrationEntry.user_id, func.date(HydrationEntry.timestamp))
+    ))
+    # HydrationDaily isn't SyncTracked; a running server only notices through SyncState
+    bump_all_sync_versions(db.session)
+    db.session.commit()
+    return db.session.query(func.count()).select_from(HydrationDaily).scalar()
+
+@app.cli.command('rebuild-hydration-rollup')
+def rebuild_hydration_rollup_command():
+    """Backfills the daily hydration rollup from existing HydrationEntry rows."""
+    print(f"Hydration rollup rebuilt: {rebuild_hydration_rollup()} user-days.")
+
+# FIX: Cursors carrying user text (usernames) are base64url JSON, because HTTP headers
+# are Latin-1 and a raw non-Latin-1 name would fail to encode.
+def encode_cursor(*parts):
+    """Opaque, header-safe pagination cursor for a tuple of JSON values."""
+    return base64.urlsafe_b64encode(json.dumps(parts).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(); raises ValueError for anything it did not produce."""
+    parts = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(parts, list):
+        raise ValueError('Invalid cursor')
+    return parts
+
+def keyset_after(columns, values):
+    """Rows strictly after values in ascending, NULLS FIRST order of columns (a NULL-safe tuple >)."""
+    def equal(column, value):
+        return column.is_(None) if value is None else column == value
+
+    def greater(column, value):
+        return column.isnot(None) if value is None else column > value
+
+    return db.or_(*[
+        db.and_(*[equal(c, v) for c, v in zip(columns[:k], values[:k])], greater(columns[k], values[k]))
+        for k in range(len(columns))
+    ])
+
+def as_utc(value):
+    """SQLite hands back naive datetimes; treat them as UTC."""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def get_data_versions(user_ids):
+    """{user_id: (in-process counter, SyncState.version)} for cache keys, with one query."""
+    user_ids = list(user_ids)
+    stored = dict(db.session.query(SyncState.user_id, SyncState.version).filter(SyncState.user_id.in_(user_ids))) if user_ids else {}
+    with _dashboard_lock:
+        return {user_id: (_data_versions.get(user_id, 0), stored.get(user_id, 0)) for user_id in user_ids}
+
+def get_data_version(user_id):
+    return get_data_versions([user_id])[user_id]
+
+def invalidate_all_dashboards():
+    """Drops every cached dashboard, for changes that are visible to all users."""
+    with _dashboard_lock:
+        user_ids = set(_data_versions) | set(_dashboard_cache)
+    invalidate_dashboard(*user_ids)
+
+def invalidate_dashboard(*user_ids):
+    """Drops the cached dashboard of every given user after their data changed."""
+    with _dashboard_lock:
+        for user_id in user_ids:
+            if user_id is None:
+                continue
+            user_id = int(user_id)
+            _data_versions[user_id] = _data_versions.get(user_id, 0) + 1
+            _dashboard_cache.pop(user_id, None)
+
+def get_dashboard_sections(user_id, names, version):
+    """Returns the cached, unexpired values for the requested sections that were built at this data version."""
+    now = datetime.now(timezone.utc)
+    with _dashboard_lock:
+        sections = _dashboard_cache.get(user_id, {})
+        return {
+            name: sections[name]['value'] for name in names
+            if name in sections and sections[name]['version'] == version and sections[name]['expires_at'] > now
+        }
+
+def store_dashboard_sections(user_id, version, computed):
+    """Caches freshly computed sections unless the user's data changed meanwhile."""
+    with _dashboard_lock:
+        if _data_versions.get(user_id, 0) != version[0]:
+            return
+        sections = _dashboard_cache.setdefault(user_id, {})
+        for name, (value, expires_at) in computed.items():
+            sections[name] = {'value': value, 'expires_at': expires_at, 'version': version}
+
+
+# --- DASHBOARD SECTIONS ---
+# Every top-level key of /api/dashboard is produced by its own provider so that
+# ?sections=wellness,notifications only runs the queries those cards need.
+# A provider returns (value, expires_at); expires_at=None means "until midnight".
+DASHBOARD_SECTIONS = {}
+
+def dashboard_section(name):
+    """Registers a dashboard section provider under the given key."""
+    def register(provider):
+        DASHBOARD_SECTIONS[name] = provider
+        return provider
+    return register
+
+@dashboard_section('user')
+def user_section(user_id, now):
+    user = db.session.get(User, user_id)
+    return {'username': user.username, 'gpa': user.gpa, 'is_admin': user.is_admin, 'id': user_id}, None
+
+@dashboard_section('wellness')
+def wellness_section(user_id, now):
+    # Single primary-key lookup on the daily rollup
+    rollup = db.session.get(HydrationDaily, (user_id, now.date()))
+    hydration_today = rollup.total_ml if rollup else 0
+
+    # Fetch all mood entries for charts and suggestions (last 30 days or so)
+    mood_history = MoodEntry.query.filter(
+        MoodEntry.user_id == user_id,
+        MoodEntry.timestamp >= now - timedelta(days=30)
+    ).order_by(MoodEntry.timestamp.asc()).all()
+
+    return {
+        'hydration_ml': hydration_today,
+        'goal_ml': 2000,
+        'mood_history': [m.to_dict() for m in mood_history]
+    }, None
+
+@dashboard_section('courses')
+def courses_section(user_id, now):
+    courses = Course.query.filter_by(user_id=user_id).all()
+    return [c.to_dict() for c in courses], None
+
+@dashboard_section('appointments')
+def appointments_section(user_id, now):
+    # Upcoming appointments (filtered by date_time >= now); stale once the first one passes
+    upcoming_appointments = Appointment.query.filter(
+        Appointment.user_id == user_id,
+        Appointment.date_time >= now
+    ).order_by(Appointment.date_time).limit(5).all()
+    expires_at = as_utc(upcoming_appointments[0].date_time) if upcoming_appointments else None
+    return [a.to_dict() for a in upcoming_appointments], expires_at
+
+@dashboard_section('timetable')
+def timetable_section(user_id, now):
+    timetable = TimetableEntry.query.filter_by(user_id=user_id).order_by(TimetableEntry.day_index, TimetableEntry.start_minute).all()
+    return [t.to_dict() for t in timetable], None
+
+@dashboard_section('upcoming_tests')
+def upcoming_tests_section(user_id, now):
+    # Upcoming tests (filtered by due date >= now); stale once the first one is due
+    upcoming_tests = Test.query.filter(Test.user_id == user_id, Test.due_date >= now).order_by(Test.due_date.asc()).all()
+    expires_at = as_utc(upcoming_tests[0].due_date) if upcoming_tests else None
+    return [t.to_dict() for t in upcoming_tests], expires_at
+
+@dashboard_section('finance')
+def finance_section(user_id, now):
+    financial_data = FinancialEntry.query.filter_by(user_id=user_id, month_year=now.strftime('%Y-%m')).all()
+    return [f.to_dict() for f in financial_data], None
+
+@dashboard_section('notifications')
+def notifications_section(user_id, now):
+    return {'unread_count': unread_counter.get(user_id)}, None
+
+@dashboard_section('study_sessions')
+def study_sessions_section(user_id, now):
+    study_sessions = StudySession.query.filter_by(user_id=user_id).order_by(StudySession.start_time.desc()).limit(10).all()
+    return [s.to_dict() for s in study_sessions], None
+
+
+# --- SCHEMA MIGRATIONS ---
+# The schema version is kept in SQLite's PRAGMA user_version. Every migration
+# newer than that runs in order at startup, so a current schema costs one PRAGMA
+# read. A new database is built by db.create_all() first and then runs them all
+# too, which is how objects the models can't express (FTS tables, triggers) get
+# created. Migrations use frozen DDL rather than the live models and must be
+# idempotent, because pysqlite commits DDL statements as it goes.
+MIGRATIONS = []
+
+def migration(description):
+    """Registers the next schema migration; versions follow registration order."""
+    def register(upgrade):
+        MIGRATIONS.append((len(MIGRATIONS) + 1, description, upgrade))
+        return upgrade
+    return register
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table}")')}
+
+def add_column(conn, table, column, ddl):
+    if column not in table_columns(conn, table):
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
+
+@migration('Change tracking columns and tables for /api/sync')
+def migrate_sync_tracking(conn):
+    for table in ['course', 'timetable_entry', 'test', 'appointment', 'notification',
+                  'financial_entry', 'study_session', 'mood_entry']:
+        add_column(conn, table, 'updated_at', 'DATETIME')
+        add_column(conn, table, 'version', 'INTEGER NOT NULL DEFAULT 0')
+        conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{table}_user_version ON {table} (user_id, version)')
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            user_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (user_id),
+            FOREIGN KEY(user_id) REFERENCES user (id)
+        )''')
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS sync_tombstone (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            table_name VARCHAR(30) NOT NULL,
+            row_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            deleted_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES user (id)
+        )''')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_sync_tombstone_user_version ON sync_tombstone (user_id, version)')
+
+@migration('Daily hydration rollup')
+def migrate_hydration_rollup(conn):
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS hydration_daily (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            total_ml INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day),
+            FOREIGN KEY(user_id) REFERENCES user (id)
+        )''')
+    conn.exec_driver_sql('DELETE FROM hydration_daily')
+    conn.exec_driver_sql('''
+        INSERT INTO hydration_daily (user_id, day, total_ml)
+        SELECT user_id, date(timestamp), SUM(amount_ml) FROM hydration_entry
+        GROUP BY user_id, date(timestamp)''')
+
+@migration('Running GPA totals on user')
+def migrate_gpa_totals(conn):
+    add_column(conn, 'user', 'quality_points', 'FLOAT NOT NULL DEFAULT 0')
+    add_column(conn, 'user', 'total_credits', 'FLOAT NOT NULL DEFAULT 0')
+    # FIX: Frozen copy of gpa_recalculation_stmt() with the grading scale as of this migration
+    conn.exec_driver_sql('''
+        UPDATE user SET quality_points = totals.quality_points, total_credits = totals.credits,
+            gpa = CASE WHEN totals.credits > 0.0001 THEN round(totals.quality_points / totals.credits, 2) ELSE 0.0 END
+        FROM (
+            SELECT user.id AS user_id,
+                coalesce(sum(CASE WHEN course.score >= 90 THEN 4.0 WHEN course.score >= 80 THEN 3.0
+                    WHEN course.score >= 70 THEN 2.0 WHEN course.score >= 60 THEN 1.0 ELSE 0.0 END * course.credits), 0.0) AS quality_points,
+                coalesce(sum(course.credits), 0.0) AS credits
+            FROM user LEFT JOIN course ON course.user_id = user.id
+            GROUP BY user.id
+        ) AS totals
+        WHERE user.id = totals.user_id''')
+
+@migration('Composite (user_id, time) indexes for per-user queries')
+def migrate_user_time_indexes(conn):
+    for name, table, columns in [
+        ('ix_mood_entry_user_timestamp', 'mood_entry', 'user_id, timestamp'),
+        ('ix_hydration_entry_user_timestamp', 'hydration_entry', 'user_id, timestamp'),
+        ('ix_notification_user_timestamp', 'notification', 'user_id, timestamp'),
+        ('ix_test_user_due_date', 'test', 'user_id, due_date'),
+        ('ix_appointment_user_date_time', 'appointment', 'user_id, date_time'),
+        ('ix_study_session_user_start_time', 'study_session', 'user_id, start_time'),
+    ]:
+        conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+@migration('Denormalized comment_count and feed index on community_post')
+def migrate_community_feed(conn):
+    add_column(conn, 'community_post', 'comment_count', 'INTEGER NOT NULL DEFAULT 0')
+    conn.exec_driver_sql('''
+        UPDATE community_post SET comment_count = (
+            SELECT COUNT(*) FROM community_comment WHERE community_comment.post_id = community_post.id
+        )''')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_community_post_timestamp_id ON community_post (timestamp, id)')
+
+@migration('FTS5 search index over community posts and comments')
+def migrate_community_search(conn):
+    # External-content FTS tables: the text lives in the base tables, triggers keep the index in step
+    conn.exec_driver_sql('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS community_post_fts USING fts5(
+            title, content, content='community_post', content_rowid='id', tokenize='porter unicode61'
+        )''')
+    conn.exec_driver_sql('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS community_comment_fts USING fts5(
+            content, content='community_comment', content_rowid='id', tokenize='porter unicode61'
+        )''')
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS community_post_fts_ai AFTER INSERT ON community_post BEGIN
+            INSERT INTO community_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+        END''')
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS community_post_fts_ad AFTER DELETE ON community_post BEGIN
+            INSERT INTO community_post_fts(community_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        END''')
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS community_post_fts_au AFTER UPDATE OF title, content ON community_post BEGIN
+            INSERT INTO community_post_fts(community_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO community_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+        END''')
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS community_comment_fts_ai AFTER INSERT ON community_comment BEGIN
+            INSERT INTO community_comment_fts(rowid, content) VALUES (new.id, new.content);
+        END''')
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS community_comment_fts_ad AFTER DELETE ON community_comment BEGIN
+            INSERT INTO community_comment_fts(community_comment_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END''')
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS community_comment_fts_au AFTER UPDATE OF content ON community_comment BEGIN
+            INSERT INTO community_comment_fts(community_comment_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO community_comment_fts(rowid, content) VALUES (new.id, new.content);
+        END''')
+    # Index whatever was written before the triggers existed
+    conn.exec_driver_sql("INSERT INTO community_post_fts(community_post_fts) VALUES ('rebuild')")
+    conn.exec_driver_sql("INSERT INTO community_comment_fts(community_comment_fts) VALUES ('rebuild')")
+
+@migration('Conversation index on direct_message')
+def migrate_direct_message_index(conn):
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_direct_message_pair_id ON direct_message (sender_id, receiver_id, id)')
+
+@migration('Conversation summaries for the inbox')
+def migrate_conversation_summaries(conn):
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS conversation_summary (
+            user_id INTEGER NOT NULL,
+            peer_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            last_message_at DATETIME NOT NULL,
+            last_read_id INTEGER NOT NULL,
+            unread_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, peer_id),
+            FOREIGN KEY(user_id) REFERENCES user (id),
+            FOREIGN KEY(peer_id) REFERENCES user (id),
+            FOREIGN KEY(last_message_id) REFERENCES direct_message (id)
+        )''')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_conversation_summary_user_last ON conversation_summary (user_id, last_message_at)')
+    # Existing history has no read state; treat it as read
+    conn.exec_driver_sql('''
+        INSERT OR IGNORE INTO conversation_summary (user_id, peer_id, last_message_id, last_message_at, last_read_id, unread_count)
+        SELECT user_id, peer_id, MAX(id), MAX(timestamp), MAX(id), 0 FROM (
+            SELECT sender_id AS user_id, receiver_id AS peer_id, id, timestamp FROM direct_message
+            UNION ALL
+            SELECT receiver_id AS user_id, sender_id AS peer_id, id, timestamp FROM direct_message
+        )
+        GROUP BY user_id, peer_id''')
+
+@migration('Case-folded username key for the user directory')
+def migrate_username_key(conn):
+    add_column(conn, 'user', 'username_key', "VARCHAR(80) NOT NULL DEFAULT ''")
+    # Folded in Python: SQLite's lower() leaves non-ASCII letters alone
+    rows = conn.exec_driver_sql('SELECT id, username FROM user').all()
+    if rows:
+        conn.exec_driver_sql('UPDATE user SET username_key = ? WHERE id = ?',
+                             [(username.strip().casefold(), user_id) for user_id, username in rows])
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_user_username_key ON user (username_key, id)')
+
+@migration('Broadcast announcements and per-user read cursors')
+def migrate_broadcasts(conn):
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS broadcast (
+            id INTEGER NOT NULL,
+            message VARCHAR(255) NOT NULL,
+            timestamp DATETIME,
+            created_by INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(created_by) REFERENCES user (id)
+        )''')
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS broadcast_cursor (
+            user_id INTEGER NOT NULL,
+            last_seen_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id),
+            FOREIGN KEY(user_id) REFERENCES user (id)
+        )''')
+
+@migration('Due-time indexes for the reminder scheduler')
+def migrate_reminder_indexes(conn):
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_test_due_date ON test (due_date)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_appointment_date_time ON appointment (date_time)')
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS reminder_marker (
+            id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (id)
+        )''')
+
+@migration('Normalized day/minute columns for timetable entries')
+def migrate_timetable_minutes(conn):
+    add_column(conn, 'timetable_entry', 'day_index', 'INTEGER')
+    add_column(conn, 'timetable_entry', 'start_minute', 'INTEGER')
+    add_column(conn, 'timetable_entry', 'end_minute', 'INTEGER')
+    conn.exec_driver_sql('''
+        UPDATE timetable_entry SET
+            day_index = CASE lower(trim(day_of_week))
+                WHEN 'monday' THEN 0 WHEN 'tuesday' THEN 1 WHEN 'wednesday' THEN 2 WHEN 'thursday' THEN 3
+                WHEN 'friday' THEN 4 WHEN 'saturday' THEN 5 WHEN 'sunday' THEN 6 END,
+            start_minute = CAST(substr(start_time, 1, instr(start_time, ':') - 1) AS INTEGER) * 60
+                + CAST(substr(start_time, instr(start_time, ':') + 1) AS INTEGER),
+            end_minute = CAST(substr(end_time, 1, instr(end_time, ':') - 1) AS INTEGER) * 60
+                + CAST(substr(end_time, instr(end_time, ':') + 1) AS INTEGER)''')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_timetable_entry_user_day_start ON timetable_entry (user_id, day_index, start_minute)')
+
+@migration('GPA sort index for the admin user list')
+def migrate_user_gpa_index(conn):
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_user_gpa_id ON user (gpa, id)')
+
+@migration('Week-order index for the admin timetable view')
+def migrate_timetable_week_index(conn):
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_timetable_entry_day_start ON timetable_entry (day_index, start_minute)')
+
+def register_fold_title(conn):
+    """Exposes the catalog's title key to SQL as fold_title(); frozen copy of normalize_course_title()."""
+    conn.connection.driver_connection.create_function(
+        'fold_title', 1, lambda title: None if title is None else title.strip().casefold(), deterministic=True
+    )
+
+@migration('Course catalog with integer references from courses, timetable entries and tests')
+def migrate_course_catalog(conn):
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS course_catalog (
+            id INTEGER NOT NULL,
+            title VARCHAR(100) NOT NULL,
+            normalized VARCHAR(100) NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (normalized)
+        )''')
+    # Tables created by create_all() never had the text columns
+    title_columns = [(table, column) for table, column in [('course', 'title'), ('timetable_entry', 'course_title'), ('test', 'course_title')]
+                     if column in table_columns(conn, table)]
+    if title_columns:
+        # Deduplicate every existing title; the first spelling seen becomes the display title
+        register_fold_title(conn)
+        all_titles = ' UNION ALL '.join(f'SELECT {column} AS title FROM {table}' for table, column in title_columns)
+        conn.exec_driver_sql(f'''
+            INSERT OR IGNORE INTO course_catalog (title, normalized)
+            SELECT trim(title), fold_title(title) FROM ({all_titles}) WHERE fold_title(title) != ''
+            ''')
+        # Blank or NULL legacy titles share one placeholder row rather than losing their
+        # reference when the text column is dropped; the API never creates an empty key
+        conn.exec_driver_sql(f'''
+            INSERT OR IGNORE INTO course_catalog (title, normalized)
+            SELECT 'Untitled course', '' WHERE EXISTS (
+                SELECT 1 FROM ({all_titles}) WHERE coalesce(fold_title(title), '') = ''
+            )''')
+    for table, column in title_columns:
+        add_column(conn, table, 'catalog_id', 'INTEGER REFERENCES course_catalog (id)')
+        conn.exec_driver_sql(f'''
+            UPDATE {table} SET catalog_id = (
+                SELECT id FROM course_catalog WHERE normalized = coalesce(fold_title({table}.{column}), '')
+            ) WHERE catalog_id IS NULL''')
+        # The title now lives only in the catalog row
+        conn.exec_driver_sql(f'ALTER TABLE {table} DROP COLUMN {column}')
+    for table in ['course', 'timetable_entry', 'test']:
+        conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{table}_catalog_id ON {table} (catalog_id)')
+
+@migration('Calendar feed versions and token generations')
+def migrate_calendar_feed(conn):
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS calendar_feed (
+            user_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            token_generation INTEGER NOT NULL,
+            PRIMARY KEY (user_id),
+            FOREIGN KEY(user_id) REFERENCES user (id)
+        )''')
+
+@migration('Random calendar feed token secrets')
+def migrate_calendar_feed_secret(conn):
+    # Generation-signed URLs are revoked; users fetch a new one from /api/calendar/feed-url
+    add_column(conn, 'calendar_feed', 'token_secret', 'VARCHAR(64)')
+    if 'token_generation' in table_columns(conn, 'calendar_feed'):
+        conn.exec_driver_sql('ALTER TABLE calendar_feed DROP COLUMN token_generation')
+
+@migration('Never reissue the ids of deleted users')
+def migrate_user_autoincrement(conn):
+    schema = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'user'").scalar()
+    if 'AUTOINCREMENT' in schema.upper():
+        return
+    # SQLite can only add AUTOINCREMENT by rebuilding the table; foreign keys name "user" and survive the swap
+    conn.exec_driver_sql('''
+        CREATE TABLE user_rebuild (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(80) NOT NULL,
+            username_key VARCHAR(80) NOT NULL,
+            password_hash VARCHAR(120) NOT NULL,
+            is_admin BOOLEAN,
+            gpa FLOAT,
+            quality_points FLOAT NOT NULL,
+            total_credits FLOAT NOT NULL,
+            UNIQUE (username)
+        )''')
+    conn.exec_driver_sql('''
+        INSERT INTO user_rebuild (id, username, username_key, password_hash, is_admin, gpa, quality_points, total_credits)
+        SELECT id, username, username_key, password_hash, is_admin, gpa, quality_points, total_credits FROM user''')
+    conn.exec_driver_sql('DROP TABLE user')
+    conn.exec_driver_sql('ALTER TABLE user_rebuild RENAME TO user')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_user_username_key ON user (username_key, id)')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_user_gpa_id ON user (gpa, id)')
+
+def upgrade_database():
+    """Brings an existing database up to the latest schema version in place."""
+    with db.engine.connect() as conn:
+        current = conn.exec_driver_sql('PRAGMA user_version').scalar()
+    for version, description, upgrade in MIGRATIONS:
+        if version <= current:
+            continue
+        with db.engine.begin() as conn:
+            upgrade(conn)
+            conn.exec_driver_sql(f'PRAGMA user_version = {version}')
+        print(f"Applied schema migration {version}: {description}")
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Applies pending schema migrations without starting the server."""
+    upgrade_database()
 
 
 def setup_database(app):
-    """Creates tables and initial demo users WITH SAMPLE DATA if they don't exist."""
+    """Creates or upgrades the schema, then adds demo users WITH SAMPLE DATA if there are none."""
     with app.app_context():
-        # --- FIX: Delete existing database file to apply new MoodEntry schema ---
-        if os.path.exists(DB_PATH):
-            try:
-                os.remove(DB_PATH)
-                print("Old database file removed due to schema change.")
-            except PermissionError:
-                # Handle the case where the previous process still holds a lock on the DB file
-                print("WARNING: Could not remove old database file due to file lock. Schema changes may not be applied.")
-        # -----------------------------------------------------------------------
-
-        db.create_all()
+        if not db.inspect(db.engine).has_table('user'):
+            db.create_all()
+        upgrade_database()
+
         if not User.query.first():
             # Create essential accounts for testing login
             student = User(username='student', password_hash='studentpass', is_admin=False, id=1, gpa=0.0)
@@ -381,6 +1375,8 @@ def setup_database(app):
             # 9. Community Comments
             db.session.add(CommunityComment(post_id=post2.id, user_id=student_id, content="Try drawing the problem setup first. Visual aids help a ton!"))
             db.session.add(CommunityComment(post_id=post1.id, user_id=user4_id, content="I listen to Lo-fi beats—super chill."))
+            bump_comment_count(post1.id)
+            bump_comment_count(post2.id)
             db.session.commit()
             
             # 10. Direct Messages (Simulated Encrypted)
@@ -393,6 +1389,460 @@ def setup_database(app):
 
             print("Initial users and sample data created.")
 
+class PrincipalCache:
+    """Bounded LRU of user id -> is_admin with a TTL, used by the auth decorators.
+
+    Only existing users are cached; manage_user() invalidates on PUT/DELETE.
+    """
+    def __init__(self, ttl_seconds, max_size):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # user_id -> (is_admin, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Returns {'is_admin': bool} for an existing user, or None if the user is gone."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[1] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return {'is_admin': entry[0]}
+            self._entries.pop(user_id, None)
+            self.misses += 1
+
+        user = db.session.get(User, user_id)
+        if not user:
+            return None
+        with self._lock:
+            self._entries[user_id] = (bool(user.is_admin), time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return {'is_admin': bool(user.is_admin)}
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'ttl_seconds': self.ttl_seconds,
+                    'hits': self.hits, 'misses': self.misses}
+
+principal_cache = PrincipalCache(app.config['PRINCIPAL_CACHE_TTL'], app.config['PRINCIPAL_CACHE_SIZE'])
+
+# --- IN-PROCESS EVENT BROKER ---
+class EventBroker:
+    """Per-user pub/sub feeding the Server-Sent Events endpoints.
+
+    Lives in this process only; clients that miss events (reconnects, other
+    workers) catch up through the regular after_id/cursor endpoints.
+    """
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {} # user_id -> {queue: set of topics}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, topics):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, {})[subscriber] = set(topics)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, {})
+            subscribers.pop(subscriber, None)
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def subscribed_users(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, user_id, topic, data):
+        """Queues an event for every open stream of the user; call after the commit."""
+        with self._lock:
+            targets = [q for q, topics in self._subscribers.get(user_id, {}).items() if topic in topics]
+        for subscriber in targets:
+            try:
+                subscriber.put_nowait((topic, data))
+            except queue.Full:
+                pass # Slow consumer; it resyncs via the REST endpoints
+
+event_broker = EventBroker()
+
+def sse_response(user_id, topics, initial_events=(), heartbeat_seconds=15):
+    """Streams the user's broker events for the given topics as text/event-stream."""
+    subscriber = event_broker.subscribe(user_id, topics)
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            for topic, data in initial_events:
+                yield f'event: {topic}\ndata: {json.dumps(data)}\n\n'
+            while True:
+                try:
+                    topic, data = subscriber.get(timeout=heartbeat_seconds)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f'event: {topic}\ndata: {json.dumps(data)}\n\n'
+        finally:
+            event_broker.unsubscribe(user_id, subscriber)
+
+    return app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+# --- NOTIFICATION STREAM ---
+def broadcast_cursor(user_id):
+    return db.session.query(BroadcastCursor.last_seen_id).filter_by(user_id=user_id).scalar() or 0
+
+def broadcast_unread_count(user_id):
+    """Broadcasts above the user's read cursor; a primary-key range count."""
+    return db.session.query(func.count(Broadcast.id)).filter(Broadcast.id > broadcast_cursor(user_id)).scalar()
+
+def advance_broadcast_cursor(user_id, up_to_id=None):
+    """Marks every broadcast up to up_to_id (default: the latest) read, in the caller's transaction."""
+    if up_to_id is None:
+        up_to_id = db.session.query(func.max(Broadcast.id)).scalar() or 0
+    db.session.execute(sqlite_insert(BroadcastCursor).values(user_id=user_id, last_seen_id=up_to_id).on_conflict_do_update(
+        index_elements=[BroadcastCursor.user_id],
+        set_={'last_seen_id': func.max(BroadcastCursor.last_seen_id, up_to_id)}
+    ))
+
+class UnreadCounter:
+    """In-memory unread notification count per user, personal and broadcast combined.
+
+    Loaded with COUNT queries the first time a user is seen, then kept current
+    by the commit hooks below instead of re-counting on every page view. A count
+    that raced with a change is returned but not kept, so the next get() recounts.
+    """
+    def __init__(self):
+        self._counts = {}
+        self._seeding = {} # user_id -> [get() calls counting, changes seen meanwhile]
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            if user_id in self._counts:
+                return self._counts[user_id]
+            seeding = self._seeding.setdefault(user_id, [0, 0])
+            seeding[0] += 1
+            changes = seeding[1]
+        try:
+            count = Notification.query.filter_by(user_id=user_id, is_read=False).count() + broadcast_unread_count(user_id)
+        finally:
+            with self._lock:
+                seeding[0] -= 1
+                if not seeding[0]:
+                    self._seeding.pop(user_id, None)
+        with self._lock:
+            if user_id in self._counts:
+                return self._counts[user_id]
+            if seeding[1] == changes:
+                self._counts[user_id] = count
+            return count
+
+    def _changed(self, user_id):
+        # Caller holds the lock
+        if user_id in self._seeding:
+            self._seeding[user_id][1] += 1
+
+    def peek(self, user_id):
+        """Returns the count if it is already loaded, without touching the database."""
+        with self._lock:
+            return self._counts.get(user_id)
+
+    def adjust(self, user_id, delta):
+        with self._lock:
+            self._changed(user_id)
+            if user_id in self._counts:
+                self._counts[user_id] = max(0, self._counts[user_id] + delta)
+
+    def adjust_all(self, delta):
+        """Applies delta to every loaded user, e.g. when a broadcast is published."""
+        with self._lock:
+            for user_id in list(self._seeding):
+                self._changed(user_id)
+            for user_id in self._counts:
+                self._counts[user_id] = max(0, self._counts[user_id] + delta)
+
+    def reset(self, user_id, count=0):
+        with self._lock:
+            self._changed(user_id)
+            self._counts[user_id] = count
+
+    def forget(self, user_id):
+        """Drops the user's count so the next get() recounts from the database."""
+        with self._lock:
+            self._changed(user_id)
+            self._counts.pop(user_id, None)
+
+unread_counter = UnreadCounter()
+
+def publish_notification_event(user_id, notification=None):
+    event_broker.publish(user_id, 'notification', {
+        'unread_count': unread_counter.peek(user_id),
+        'notification': notification,
+    })
+
+@event.listens_for(Session, 'after_flush')
+def collect_notification_changes(session_obj, flush_context):
+    """Remembers created / newly read notifications until the transaction commits."""
+    pending = session_obj.info.setdefault('notification_changes', [])
+    for obj in session_obj.new:
+        if isinstance(obj, Notification):
+            pending.append((int(obj.user_id), 0 if obj.is_read else 1, obj.to_dict()))
+    for obj in session_obj.dirty:
+        if isinstance(obj, Notification):
+            history = attributes.get_history(obj, 'is_read')
+            if history.added and history.added[0] and not (history.deleted and history.deleted[0]):
+                pending.append((int(obj.user_id), -1, obj.to_dict()))
+
+@event.listens_for(Session, 'after_commit')
+def publish_notification_changes(session_obj):
+    for user_id, delta, notification in session_obj.info.pop('notification_changes', []):
+        unread_counter.adjust(user_id, delta)
+        invalidate_dashboard(user_id)
+        publish_notification_event(user_id, notification)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_notification_changes(session_obj, previous_transaction):
+    session_obj.info.pop('notification_changes', None)
+
+# --- REMINDER SCHEDULER ---
+# Model, due-time column and message per reminder kind
+REMINDER_KINDS = {
+    'test': (Test, Test.due_date, lambda t, lead: f'Reminder: {t.course_title} {t.type} is due in {lead}.'),
+    'appointment': (Appointment, Appointment.date_time, lambda a, lead: f'Reminder: your {a.type} appointment starts in {lead}.'),
+}
+
+def describe_lead(lead):
+    if lead % timedelta(days=1) == timedelta(0):
+        days = lead // timedelta(days=1)
+        return f"{days} day{'s' if days != 1 else ''}"
+    if lead % timedelta(hours=1) == timedelta(0):
+        hours = lead // timedelta(hours=1)
+        return f"{hours} hour{'s' if hours != 1 else ''}"
+    minutes = lead // timedelta(minutes=1)
+    return f"{minutes} minute{'s' if minutes != 1 else ''}"
+
+def reminder_marker_version():
+    return db.session.query(ReminderMarker.version).filter_by(id=1).scalar() or 0
+
+def bump_reminder_marker(session_obj):
+    """Signals the scheduler of another process; a no-op where this process runs its own."""
+    if reminder_scheduler.running:
+        return
+    session_obj.connection().execute(sqlite_insert(ReminderMarker).values(id=1, version=1).on_conflict_do_update(
+        index_elements=[ReminderMarker.id], set_={'version': ReminderMarker.version + 1}
+    ))
+
+class ReminderScheduler:
+    """Background thread that turns upcoming due times into Notification rows.
+
+    Keeps a min-heap of (fire_at, kind, row_id, due_at, lead) for the rows due
+    within the loaded window and sleeps until the earliest entry (or the next
+    window refill) instead of polling the tables row by row. Entries are checked
+    against the row when they fire, so deleted or rescheduled rows are skipped.
+    Reminders whose time passed while the app was down are not sent.
+
+    Writes from this process arrive through schedule(). Processes without a
+    scheduler (e.g. the import-schedule CLI) bump ReminderMarker instead; the
+    scheduler reads that one row every check_interval and rescans its loaded
+    window only when it moved, queueing rows it does not know yet.
+    """
+    def __init__(self, lead_times, batch_size=500, window=timedelta(days=1), check_interval=timedelta(seconds=30)):
+        self.lead_times = sorted(lead_times)
+        self.batch_size = batch_size
+        self.window = window
+        self.check_interval = check_interval
+        self._heap = []
+        self._cancelled = set() # (kind, row_id) of rows deleted since they were queued
+        self._known = set() # (kind, row_id, due_at) already queued, so rescans don't double up
+        self._loaded_until = None # rows due up to here are in the heap
+        self._marker = None # last ReminderMarker.version seen
+        self._checked_at = None
+        self._cond = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, flask_app):
+        with self._start_lock:
+            if self._thread:
+                return
+            self._app = flask_app
+            with flask_app.app_context():
+                self._load(datetime.now(timezone.utc))
+            self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+            self._thread.start()
+
+    def schedule(self, kind, row_id, due_at):
+        """Queues reminders for a new or rescheduled row; no-op for rows beyond the loaded window."""
+        with self._cond:
+            if self._loaded_until is None or as_utc(due_at) > self._loaded_until:
+                return
+            if (kind, row_id, as_utc(due_at)) in self._known:
+                return # a rescan got to it first
+            self._cancelled.discard((kind, row_id))
+            self._push(kind, row_id, as_utc(due_at), datetime.now(timezone.utc))
+            self._cond.notify()
+
+    def cancel(self, kind, row_id):
+        with self._cond:
+            if self._loaded_until is not None:
+                self._cancelled.add((kind, row_id))
+
+    def _push(self, kind, row_id, due_at, now):
+        self._known.add((kind, row_id, due_at))
+        for lead in self.lead_times:
+            fire_at = due_at - lead
+            if fire_at > now:
+                heapq.heappush(self._heap, (fire_at, kind, row_id, due_at, lead))
+
+    def _scan(self, start, end):
+        """Range-scans the due-time indexes for rows due in (start, end]."""
+        rows = []
+        for kind, (model, due_column, _) in REMINDER_KINDS.items():
+            rows += [(kind, row_id, as_utc(due_at)) for row_id, due_at in db.session.query(model.id, due_column).filter(
+                due_column > start, due_column <= end
+            )]
+        db.session.remove()
+        return rows
+
+    def _load(self, now):
+        """Queues the next window of rows."""
+        marker = reminder_marker_version()
+        end = now + self.lead_times[-1] + self.window
+        rows = self._scan(self._loaded_until or now, end)
+        with self._cond:
+            for kind, row_id, due_at in rows:
+                self._push(kind, row_id, due_at, now)
+            self._loaded_until = end
+            if self._marker is None:
+                self._marker = marker
+            self._checked_at = now
+
+    def _check_marker(self, now):
+        """One primary-key read; rescans the loaded window only if another process changed reminder rows."""
+        marker = reminder_marker_version()
+        rows = self._scan(now, self._loaded_until) if marker != self._marker else []
+        db.session.remove()
+        with self._cond:
+            self._known = {key for key in self._known if key[2] > now}
+            for kind, row_id, due_at in rows:
+                if (kind, row_id, due_at) not in self._known:
+                    self._cancelled.discard((kind, row_id))
+                    self._push(kind, row_id, due_at, now)
+            self._marker = marker
+            self._checked_at = now
+
+    def _next_refill(self):
+        return self._loaded_until - self.lead_times[-1]
+
+    def _next_wake(self):
+        wake_at = min(self._next_refill(), self._checked_at + self.check_interval)
+        return min(self._heap[0][0], wake_at) if self._heap else wake_at
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = datetime.now(timezone.utc)
+                wake_at = self._next_wake()
+                if wake_at > now:
+                    self._cond.wait((wake_at - now).total_seconds())
+                    continue
+                batch = []
+                while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                    entry = heapq.heappop(self._heap)
+                    if (entry[1], entry[2]) not in self._cancelled:
+                        batch.append(entry)
+                refill = self._next_refill() <= now
+                check = self._checked_at + self.check_interval <= now
+                if not self._heap:
+                    self._cancelled.clear()
+            with self._app.app_context():
+                try:
+                    if batch:
+                        self._emit(batch)
+                    if refill:
+                        self._load(now)
+                    elif check:
+                        self._check_marker(now)
+                except Exception:
+                    self._app.logger.exception('Reminder batch failed')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def _emit(self, batch):
+        """Writes one Notification per still-valid entry in a single commit."""
+        notifications = []
+        for kind, (model, due_column, describe) in REMINDER_KINDS.items():
+            entries = [entry for entry in batch if entry[1] == kind]
+            if not entries:
+                continue
+            rows = {row.id: row for row in model.query.filter(model.id.in_({entry[2] for entry in entries}))}
+            for _, _, row_id, due_at, lead in entries:
+                row = rows.get(row_id)
+                # Skip rows deleted or moved since they were queued (a move queues fresh entries)
+                if row is None or as_utc(getattr(row, due_column.key)) != due_at:
+                    continue
+                notifications.append(Notification(user_id=row.user_id, message=describe(row, describe_lead(lead))))
+        if notifications:
+            db.session.add_all(notifications)
+            db.session.commit()
+
+reminder_scheduler = ReminderScheduler(app.config['REMINDER_LEAD_TIMES'], app.config['REMINDER_BATCH_SIZE'],
+                                       check_interval=app.config['REMINDER_MARKER_CHECK_INTERVAL'])
+
+# FIX: Started by the first request a process serves, so it runs under `flask run`, app.run()
+# and WSGI servers alike, but never in CLI commands or the debug reloader's watcher process.
+@app.before_request
+def start_reminder_scheduler():
+    if app.config['REMINDER_SCHEDULER_ENABLED'] and not reminder_scheduler.running:
+        reminder_scheduler.start(app)
+
+@event.listens_for(Session, 'after_flush')
+def collect_reminder_changes(session_obj, flush_context):
+    """Remembers inserted, rescheduled and deleted tests/appointments until the commit."""
+    pending = session_obj.info.setdefault('reminder_changes', [])
+    queued = len(pending)
+    for kind, (model, due_column, _) in REMINDER_KINDS.items():
+        for obj in session_obj.new:
+            if isinstance(obj, model):
+                pending.append(('schedule', kind, obj.id, getattr(obj, due_column.key)))
+        for obj in session_obj.dirty:
+            if isinstance(obj, model) and attributes.get_history(obj, due_column.key).has_changes():
+                pending.append(('schedule', kind, obj.id, getattr(obj, due_column.key)))
+        for obj in session_obj.deleted:
+            if isinstance(obj, model):
+                pending.append(('cancel', kind, obj.id, None))
+    if any(action == 'schedule' for action, *_ in pending[queued:]):
+        bump_reminder_marker(session_obj)
+
+@event.listens_for(Session, 'after_commit')
+def apply_reminder_changes(session_obj):
+    for action, kind, row_id, due_at in session_obj.info.pop('reminder_changes', []):
+        if action == 'schedule':
+            reminder_scheduler.schedule(kind, row_id, due_at)
+        else:
+            reminder_scheduler.cancel(kind, row_id)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_reminder_changes(session_obj, previous_transaction):
+    session_obj.info.pop('reminder_changes', None)
+
 def login_required(f):
     """A decorator to restrict access to authenticated users."""
     @wraps(f)
@@ -400,12 +1850,10 @@ def login_required(f):
         if 'user_id' not in session:
             return jsonify({'message': 'Authentication required'}), 401
         
-        # Check if user exists
-        with Session(db.engine) as session_obj:
-            user = session_obj.get(User, session['user_id'])
-            if not user:
-                session.pop('user_id', None)
-                return jsonify({'message': 'User not found, re-authentication required'}), 401
+        # Check if user exists (served from the principal cache on repeat calls)
+        if not principal_cache.get(session['user_id']):
+            session.pop('user_id', None)
+            return jsonify({'message': 'User not found, re-authentication required'}), 401
         
         return f(*args, **kwargs)
     return decorated_function
@@ -418,10 +1866,9 @@ def admin_required(f):
             return jsonify({'message': 'Authentication required'}), 401
         
         # Check if user is admin
-        with Session(db.engine) as session_obj:
-            user = session_obj.get(User, session['user_id'])
-            if not user or not user.is_admin:
-                return jsonify({'message': 'Admin privilege required'}), 403
+        principal = principal_cache.get(session['user_id'])
+        if not principal or not principal['is_admin']:
+            return jsonify({'message': 'Admin privilege required'}), 403
         
         return f(*args, **kwargs)
     return decorated_function
@@ -491,6 +1938,9 @@ def signup():
 
     new_user = User(username=username, password_hash=password, is_admin=False, gpa=0.0)
     db.session.add(new_user)
+    db.session.flush()
+    # FIX: Announcements sent before the account existed don't count as unread
+    advance_broadcast_cursor(new_user.id)
     db.session.commit()
     
     # Log in the new user immediately
@@ -517,70 +1967,51 @@ def logout():
 @app.route('/api/dashboard', methods=['GET'])
 @login_required
 def dashboard_data():
-    """Fetches combined dashboard data for the logged-in user."""
+    """Fetches dashboard data for the logged-in user.
+
+    ?sections=wellness,notifications limits the response to those keys; only the
+    missing or expired sections are recomputed. Per-section time is reported in
+    the Server-Timing header.
+    """
     user_id = session['user_id']
-    
-    with Session(db.engine) as session_obj:
-        user = session_obj.get(User, user_id)
-    
-        now = datetime.now(timezone.utc) 
-        today = now.date()
-        current_month_year = today.strftime('%Y-%m')
-
-        # 1. Wellness Data
-        hydration_today = db.session.query(func.sum(HydrationEntry.amount_ml)).filter(
-            HydrationEntry.user_id == user_id,
-            # Fix: Use isoformat on a date object, not a datetime object to match Python date object output
-            func.date(HydrationEntry.timestamp) == today.isoformat() 
-        ).scalar() or 0
-        
-        # Fetch all mood entries for charts and suggestions (last 30 days or so)
-        # This query relies on the new 'timestamp' column being present.
-        mood_history = MoodEntry.query.filter(
-            MoodEntry.user_id == user_id,
-            MoodEntry.timestamp >= now - timedelta(days=30)
-        ).order_by(MoodEntry.timestamp.asc()).all()
-        
-        # 2. Academic Data
-        courses = Course.query.filter_by(user_id=user_id).all()
-        user_gpa = user.gpa
-        
-        # Study Session Data
-        study_sessions = StudySession.query.filter_by(user_id=user_id).order_by(StudySession.start_time.desc()).limit(10).all()
 
-        # 3. Scheduling Data
-        timetable = TimetableEntry.query.filter_by(user_id=user_id).order_by(TimetableEntry.start_time.asc()).all()
-        
-        # Upcoming tests (filtered by due date >= now)
-        upcoming_tests = Test.query.filter(Test.user_id == user_id, Test.due_date >= now).order_by(Test.due_date.asc()).all() 
-        
-        # Upcoming appointments (filtered by date_time >= now)
-        upcoming_appointments = Appointment.query.filter(
-            Appointment.user_id == user_id,
-            Appointment.date_time >= now
-        ).order_by(Appointment.date_time).limit(5).all()
-
-        # 4. Financial Data
-        financial_data = FinancialEntry.query.filter_by(user_id=user_id, month_year=current_month_year).all()
-        
-        # 5. Notifications
-        unread_notifications_count = Notification.query.filter_by(user_id=user_id, is_read=False).count()
-        
-        return jsonify({
-            'user': {'username': user.username, 'gpa': user_gpa, 'is_admin': user.is_admin, 'id': user_id},
-            'wellness': {
-                'hydration_ml': hydration_today, 
-                'goal_ml': 2000, 
-                'mood_history': [m.to_dict() for m in mood_history]
-            },
-            'courses': [c.to_dict() for c in courses],
-            'appointments': [a.to_dict() for a in upcoming_appointments],
-            'timetable': [t.to_dict() for t in timetable], 
-            'upcoming_tests': [t.to_dict() for t in upcoming_tests], 
-            'finance': [f.to_dict() for f in financial_data],
-            'notifications': {'unread_count': unread_notifications_count},
-            'study_sessions': [s.to_dict() for s in study_sessions]
-        })
+    requested = request.args.get('sections')
+    if requested:
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in DASHBOARD_SECTIONS]
+        if unknown:
+            return jsonify({'message': f"Unknown dashboard sections: {', '.join(unknown)}"}), 400
+    else:
+        names = list(DASHBOARD_SECTIONS)
+
+    version = get_data_version(user_id)
+    cached = get_dashboard_sections(user_id, names, version)
+    now = datetime.now(timezone.utc)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+
+    payload = {}
+    computed = {}
+    timings = []
+    for name in names:
+        if name in cached:
+            payload[name] = cached[name]
+            timings.append(f'{name};desc="cache";dur=0')
+            continue
+        started = time.perf_counter()
+        value, expires_at = DASHBOARD_SECTIONS[name](user_id, now)
+        timings.append(f'{name};dur={(time.perf_counter() - started) * 1000:.2f}')
+        payload[name] = value
+        computed[name] = (value, min(expires_at, midnight) if expires_at else midnight)
+
+    if computed:
+        store_dashboard_sections(user_id, version, computed)
+
+    body = app.json.dumps(payload)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body.encode('utf-8')).hexdigest())
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Server-Timing'] = ', '.join(timings)
+    return response.make_conditional(request)
 
 # --- APIS (Student Data Management) ---
 
@@ -598,19 +2029,38 @@ def add_hydration():
     if not amount_ml or not isinstance(amount_ml, int) or amount_ml <= 0:
         return jsonify({'message': 'Invalid amount_ml'}), 400
     
-    new_entry = HydrationEntry(user_id=user_id, amount_ml=amount_ml) 
+    # Entry and daily rollup are written in the same transaction
+    now = datetime.now(timezone.utc)
+    new_entry = HydrationEntry(user_id=user_id, amount_ml=amount_ml, timestamp=now)
     db.session.add(new_entry)
+    hydration_today = record_hydration(user_id, amount_ml, now)
+    # Hydration rows aren't SyncTracked; bump by hand so other processes drop cached dashboards
+    bump_sync_version(db.session, user_id)
     db.session.commit()
-    
-    # Recalculate hydration total to return the new amount to the frontend without a full refresh
-    today = datetime.now(timezone.utc).date()
-    hydration_today = db.session.query(func.sum(HydrationEntry.amount_ml)).filter(
-        HydrationEntry.user_id == user_id,
-        func.date(HydrationEntry.timestamp) == today.isoformat()
-    ).scalar() or 0
+    invalidate_dashboard(user_id)
     
     return jsonify({'success': True, 'message': f'Added {amount_ml}ml', 'total_today': hydration_today}), 201
 
+@app.route('/api/hydration/history', methods=['GET'])
+@login_required
+def hydration_history():
+    """Daily hydration totals for the last ?days=N days (default 7), read from the rollup."""
+    user_id = session['user_id']
+    days = max(1, min(request.args.get('days', 7, type=int), 366))
+    today = datetime.now(timezone.utc).date()
+    first_day = today - timedelta(days=days - 1)
+
+    rows = HydrationDaily.query.filter(
+        HydrationDaily.user_id == user_id,
+        HydrationDaily.day >= first_day
+    ).all()
+    totals = {row.day: row.total_ml for row in rows}
+
+    return jsonify([
+        {'day': (first_day + timedelta(days=i)).isoformat(), 'total_ml': totals.get(first_day + timedelta(days=i), 0)}
+        for i in range(days)
+    ])
+
 # NEW: Study Session Endpoints
 @app.route('/api/study_session', methods=['POST'])
 @login_required
@@ -633,6 +2083,7 @@ def log_study_session():
     )
     db.session.add(new_session)
     db.session.commit()
+    invalidate_dashboard(session['user_id'])
     
     return jsonify({'success': True, 'session': new_session.to_dict()}), 201
 
@@ -660,6 +2111,7 @@ def log_mood():
     )
     db.session.add(new_entry)
     db.session.commit()
+    invalidate_dashboard(user_id)
     return jsonify({'success': True, 'message': 'Mood logged successfully'}), 201
 
 @app.route('/api/appointments', methods=['POST'])
@@ -685,8 +2137,38 @@ def book_appointment():
     new_app = Appointment(user_id=session['user_id'], type=app_type, date_time=date_time, details=details)
     db.session.add(new_app)
     db.session.commit()
+    invalidate_dashboard(session['user_id'])
     return jsonify({'success': True, 'appointment': new_app.to_dict()}), 201
 
+def build_timetable_entry(user_id, data):
+    """Validates a timetable POST body; returns (entry, None) or (None, error response)."""
+    course_title = data.get('course_title')
+    day_of_week = data.get('day_of_week')
+    start_time = data.get('start_time')
+    end_time = data.get('end_time')
+    location = data.get('location')
+
+    if not all([user_id, course_title, day_of_week, start_time, end_time]):
+        return None, (jsonify({'message': 'Missing required fields'}), 400)
+
+    try:
+        entry = TimetableEntry(user_id=user_id, course_title=course_title, day_of_week=day_of_week, start_time=start_time, end_time=end_time, location=location)
+    except ValueError:
+        return None, (jsonify({'message': 'Invalid course_title, day_of_week or time (use HH:MM)'}), 400)
+    if entry.end_minute <= entry.start_minute:
+        return None, (jsonify({'message': 'End time must be after start time'}), 400)
+
+    # Index range scan over the user's classes that day starting before this one ends
+    clash = TimetableEntry.query.filter(
+        TimetableEntry.user_id == user_id,
+        TimetableEntry.day_index == entry.day_index,
+        TimetableEntry.start_minute < entry.end_minute,
+        TimetableEntry.end_minute > entry.start_minute
+    ).order_by(TimetableEntry.start_minute).first()
+    if clash:
+        return None, (jsonify({'message': f'Overlaps with {clash.course_title} ({clash.day_of_week} {clash.start_time}-{clash.end_time})'}), 409)
+    return entry, None
+
 @app.route('/api/timetable', methods=['GET', 'POST', 'DELETE'])
 @login_required
 def student_manage_timetable():
@@ -694,24 +2176,18 @@ def student_manage_timetable():
     user_id = session['user_id']
 
     if request.method == 'GET':
-        entries = TimetableEntry.query.filter_by(user_id=user_id).order_by(asc(TimetableEntry.day_of_week), asc(TimetableEntry.start_time)).all()
+        entries = TimetableEntry.query.filter_by(user_id=user_id).order_by(TimetableEntry.day_index, TimetableEntry.start_minute).all()
         return jsonify([e.to_dict() for e in entries])
 
     data = request.get_json()
 
     if request.method == 'POST':
-        course_title = data.get('course_title')
-        day_of_week = data.get('day_of_week')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
-        location = data.get('location')
-
-        if not all([course_title, day_of_week, start_time, end_time]):
-            return jsonify({'message': 'Missing required fields'}), 400
-
-        new_entry = TimetableEntry(user_id=user_id, course_title=course_title, day_of_week=day_of_week, start_time=start_time, end_time=end_time, location=location)
+        new_entry, error = build_timetable_entry(user_id, data)
+        if error:
+            return error
         db.session.add(new_entry)
         db.session.commit()
+        invalidate_dashboard(user_id)
         return jsonify({'success': True, 'message': 'Timetable entry added.'}), 201
 
     if request.method == 'DELETE':
@@ -722,8 +2198,142 @@ def student_manage_timetable():
                 return jsonify({'message': 'Entry not found or unauthorized'}), 404
             session_obj.delete(entry)
             session_obj.commit()
+            invalidate_dashboard(user_id)
             return jsonify({'success': True, 'message': 'Timetable entry deleted.'}), 200
 
+def free_slots(busy, window_start, window_end, min_minutes):
+    """Gaps of at least min_minutes between (start, end) intervals sorted by start, within the window."""
+    slots = []
+    cursor = window_start
+    for start, end in busy:
+        if start > cursor:
+            slots.append((cursor, min(start, window_end)))
+        cursor = max(cursor, end)
+    if cursor < window_end:
+        slots.append((cursor, window_end))
+    return [(start, end) for start, end in slots if end - start >= min_minutes]
+
+@app.route('/api/timetable/free', methods=['GET'])
+@login_required
+def timetable_free():
+    """Free slots per weekday between ?from=HH:MM and ?to=HH:MM (default 08:00-20:00) of at least ?min_minutes=30."""
+    user_id = session['user_id']
+    try:
+        window_start = clock_to_minutes(request.args.get('from', '08:00'))
+        window_end = clock_to_minutes(request.args.get('to', '20:00'))
+    except ValueError:
+        return jsonify({'message': 'from/to must be HH:MM'}), 400
+    if window_end <= window_start:
+        return jsonify({'message': 'to must be after from'}), 400
+    min_minutes = max(1, request.args.get('min_minutes', 30, type=int))
+
+    # Rows arrive sorted from the (user_id, day_index, start_minute) index, so each day is one linear sweep
+    busy = {day: [] for day in range(7)}
+    for day, start, end in db.session.query(TimetableEntry.day_index, TimetableEntry.start_minute, TimetableEntry.end_minute).filter(
+        TimetableEntry.user_id == user_id,
+        TimetableEntry.day_index.isnot(None),
+        TimetableEntry.start_minute < window_end,
+        TimetableEntry.end_minute > window_start
+    ).order_by(TimetableEntry.day_index, TimetableEntry.start_minute):
+        busy[day].append((start, end))
+
+    return jsonify([
+        {'day_of_week': DAYS_OF_WEEK[day], 'start_time': minutes_to_clock(start), 'end_time': minutes_to_clock(end), 'minutes': end - start}
+        for day in range(7)
+        for start, end in free_slots(busy[day], window_start, window_end, min_minutes)
+    ])
+
+# --- STUDY GROUP PLANNING ---
+# Weekly busy bitmap per user: bit day * 1440 + minute is set while the user is in class.
+# Cached against CalendarFeed.version, which every timetable write bumps in its own
+# transaction (from any process) and which mood, finance or notification writes leave alone.
+MINUTES_PER_DAY = 24 * 60
+_busy_bitmap_cache = {} # user_id -> (calendar version, bitmap)
+
+def busy_bitmaps(user_ids):
+    """Returns {user_id: bitmap}, loading every cache miss with one query."""
+    bitmaps = {}
+    versions = {}
+    user_ids = list(user_ids)
+    stored = dict(db.session.query(CalendarFeed.user_id, CalendarFeed.version).filter(CalendarFeed.user_id.in_(user_ids))) if user_ids else {}
+    for user_id in user_ids:
+        version = stored.get(user_id, 0)
+        cached = _busy_bitmap_cache.get(user_id)
+        if cached and cached[0] == version:
+            bitmaps[user_id] = cached[1]
+        else:
+            versions[user_id] = version
+            bitmaps[user_id] = 0
+
+    if versions:
+        for user_id, day, start, end in db.session.query(
+            TimetableEntry.user_id, TimetableEntry.day_index, TimetableEntry.start_minute, TimetableEntry.end_minute
+        ).filter(
+            TimetableEntry.user_id.in_(list(versions)),
+            TimetableEntry.day_index.isnot(None),
+            TimetableEntry.end_minute > TimetableEntry.start_minute # FIX: legacy rows may end before they start
+        ):
+            bitmaps[user_id] |= ((1 << (end - start)) - 1) << (day * MINUTES_PER_DAY + start)
+        if len(_busy_bitmap_cache) > 50000:
+            _busy_bitmap_cache.clear()
+        for user_id, version in versions.items():
+            _busy_bitmap_cache[user_id] = (version, bitmaps[user_id])
+    return bitmaps
+
+@app.route('/api/groups/common-slots', methods=['POST'])
+@login_required
+def group_common_slots():
+    """Weekly windows where the caller and every listed classmate are free.
+
+    Body: {"user_ids": [...], "from": "08:00", "to": "20:00", "min_minutes": 30}
+    """
+    data = request.get_json() or {}
+    if not isinstance(data.get('user_ids', []), list):
+        return jsonify({'message': 'user_ids must be a list of integers'}), 400
+    try:
+        user_ids = {int(user_id) for user_id in data.get('user_ids', [])}
+        window_start = clock_to_minutes(data.get('from', '08:00'))
+        window_end = clock_to_minutes(data.get('to', '20:00'))
+        min_minutes = max(1, int(data.get('min_minutes', 30)))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'user_ids must be integers and from/to HH:MM'}), 400
+    if window_end <= window_start:
+        return jsonify({'message': 'to must be after from'}), 400
+    user_ids.add(session['user_id'])
+    if len(user_ids) > 500:
+        return jsonify({'message': 'At most 500 users per group'}), 400
+
+    # FIX: Free/busy patterns are only shared between users taking a course together
+    # (an integer catalog_id match); unknown ids get the same answer as strangers.
+    caller_courses = db.select(Course.catalog_id).where(Course.user_id == session['user_id'])
+    classmates = {row[0] for row in db.session.query(Course.user_id).filter(
+        Course.user_id.in_(list(user_ids)), Course.catalog_id.in_(caller_courses)
+    ).distinct()}
+    classmates.add(session['user_id'])
+    if classmates != user_ids:
+        return jsonify({'message': 'You can only plan with users who share a course with you',
+                        'user_ids': sorted(user_ids - classmates)}), 403
+
+    # The group is busy wherever anyone is; one OR per member
+    group_busy = 0
+    for bitmap in busy_bitmaps(sorted(user_ids)).values():
+        group_busy |= bitmap
+
+    slots = []
+    for day in range(7):
+        day_busy = group_busy >> (day * MINUTES_PER_DAY)
+        run_start = None
+        for minute in range(window_start, window_end + 1):
+            free = minute < window_end and not (day_busy >> minute) & 1
+            if free and run_start is None:
+                run_start = minute
+            elif not free and run_start is not None:
+                if minute - run_start >= min_minutes:
+                    slots.append({'day_of_week': DAYS_OF_WEEK[day], 'start_time': minutes_to_clock(run_start),
+                                  'end_time': minutes_to_clock(minute), 'minutes': minute - run_start})
+                run_start = None
+    return jsonify(slots)
+
 @app.route('/api/notifications', methods=['GET', 'POST'])
 @login_required
 def manage_notifications():
@@ -731,13 +2341,33 @@ def manage_notifications():
     
     if request.method == 'GET':
         notifications = Notification.query.filter_by(user_id=user_id).order_by(Notification.timestamp.desc()).limit(20).all()
-        return jsonify([n.to_dict() for n in notifications])
+        # Latest broadcasts come off the primary key; read state is just a comparison with the cursor
+        last_seen_id = broadcast_cursor(user_id)
+        broadcasts = Broadcast.query.order_by(Broadcast.id.desc()).limit(20).all()
+        merged = [n.to_dict() for n in notifications] + [b.to_dict(is_read=b.id <= last_seen_id) for b in broadcasts]
+        merged.sort(key=lambda item: item['timestamp'], reverse=True)
+        return jsonify(merged[:20])
 
     if request.method == 'POST':
         data = request.get_json()
         action = data.get('action')
         
         if action == 'mark_read':
+            broadcast_id = data.get('broadcast_id')
+            if broadcast_id:
+                try:
+                    broadcast_id = int(broadcast_id)
+                except (TypeError, ValueError):
+                    return jsonify({'message': 'broadcast_id must be an integer'}), 400
+                # Cursor semantics: marks this broadcast and every older one read
+                advance_broadcast_cursor(user_id, broadcast_id)
+                db.session.commit()
+                unread_counter.forget(user_id)
+                unread_counter.get(user_id)
+                invalidate_dashboard(user_id)
+                publish_notification_event(user_id)
+                return jsonify({'success': True, 'message': 'Broadcast marked as read'}), 200
+
             notification_id = data.get('id')
             if notification_id:
                 with Session(db.engine) as session_obj:
@@ -749,15 +2379,33 @@ def manage_notifications():
             
             # Mark all as read
             # Use synchronize_session='fetch' to ensure state is updated across different contexts
+            # Bulk updates skip the flush hooks, so stamp the sync version here
             Notification.query.filter_by(user_id=user_id, is_read=False).update(
-                {Notification.is_read: True}, 
+                {
+                    Notification.is_read: True,
+                    Notification.version: bump_sync_version(db.session, user_id),
+                    Notification.updated_at: datetime.now(timezone.utc)
+                },
                 synchronize_session='fetch'
             )
+            advance_broadcast_cursor(user_id)
             db.session.commit()
+            # The bulk update bypasses the flush hooks, so update the counter and stream here
+            unread_counter.reset(user_id)
+            invalidate_dashboard(user_id)
+            publish_notification_event(user_id)
             return jsonify({'success': True, 'message': 'All notifications marked as read'}), 200
 
     return jsonify({'message': 'Invalid action'}), 400
 
+@app.route('/api/notifications/stream', methods=['GET'])
+@login_required
+def notification_stream():
+    """Server-Sent Events channel with the live unread count and newly created notifications."""
+    user_id = session['user_id']
+    snapshot = ('notification', {'unread_count': unread_counter.get(user_id), 'notification': None})
+    return sse_response(user_id, ['notification'], initial_events=[snapshot])
+
 @app.route('/api/finance', methods=['GET', 'POST'])
 @login_required
 def manage_finance():
@@ -772,11 +2420,8 @@ def manage_finance():
         data = request.get_json()
         entries = data.get('entries', [])
 
-        # 1. Delete all existing entries for the current user and current month
-        FinancialEntry.query.filter_by(user_id=user_id, month_year=current_month_year).delete()
-        
-        # 2. Add new entries
-        new_entries = []
+        # 1. Validate the submitted budget (category -> amount; a repeated category keeps its last amount)
+        submitted = {}
         for entry in entries:
             category = entry.get('category')
             amount = entry.get('amount')
@@ -790,22 +2435,120 @@ def manage_finance():
                 if amount < 0:
                     return jsonify({'message': f'Amount for {category} cannot be negative.'}), 400
 
-                new_entry = FinancialEntry(
-                    user_id=user_id, 
-                    category=category, 
-                    amount=amount, 
-                    month_year=current_month_year
-                )
-                new_entries.append(new_entry)
-        
-        db.session.add_all(new_entries)
-        db.session.commit()
+                submitted[category] = amount
+
+        # 2. Diff against the saved month (looked up through the _user_category_month_uc index)
+        # and write only what changed; ORM writes keep the sync versions and tombstones correct
+        existing = {
+            e.category: e for e in
+            FinancialEntry.query.filter_by(user_id=user_id, month_year=current_month_year).all()
+        }
+        changed = 0
+        for category, old_entry in existing.items():
+            if category not in submitted:
+                db.session.delete(old_entry)
+                changed += 1
+            elif old_entry.amount != submitted[category]:
+                old_entry.amount = submitted[category]
+                changed += 1
+        for category, amount in submitted.items():
+            if category not in existing:
+                db.session.add(FinancialEntry(user_id=user_id, category=category, amount=amount, month_year=current_month_year))
+                changed += 1
+
+        if changed:
+            db.session.commit()
+            invalidate_dashboard(user_id)
         
-        return jsonify({'success': True, 'message': 'Monthly budget saved successfully!'}), 200
+        return jsonify({'success': True, 'message': 'Monthly budget saved successfully!', 'changed': changed}), 200
+
+# Finance history per (user_id, from, to), valid while the user's data version is unchanged
+_finance_history_cache = {}
+
+def parse_month(value):
+    """Validates a 'YYYY-MM' string and returns it as (year, month)."""
+    parsed = datetime.strptime(value, '%Y-%m')
+    return parsed.year, parsed.month
+
+def month_range(start, end):
+    """Every 'YYYY-MM' from start to end inclusive, given (year, month) tuples."""
+    year, month = start
+    months = []
+    while (year, month) <= end:
+        months.append(f'{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+@app.route('/api/finance/history', methods=['GET'])
+@login_required
+def finance_history():
+    """Per-category monthly amounts, income/expense/net totals and month-over-month change for ?from=YYYY-MM&to=YYYY-MM."""
+    user_id = session['user_id']
+    today = date.today()
+    default_from = (today.year - 1, today.month + 1) if today.month < 12 else (today.year, 1) # last 12 months
+    try:
+        start = parse_month(request.args['from']) if request.args.get('from') else default_from
+        end = parse_month(request.args['to']) if request.args.get('to') else (today.year, today.month)
+    except ValueError:
+        return jsonify({'message': 'from/to must be YYYY-MM'}), 400
+    # FIX: Check the span arithmetically before month_range() walks it
+    span = (end[0] * 12 + end[1]) - (start[0] * 12 + start[1]) + 1
+    if not 1 <= span <= 60:
+        return jsonify({'message': 'Range must cover 1 to 60 months'}), 400
+    months = month_range(start, end)
+
+    cache_key = (user_id, months[0], months[-1])
+    version = get_data_version(user_id)
+    cached = _finance_history_cache.get(cache_key)
+    if cached and cached[0] == version:
+        return jsonify(cached[1])
+
+    # Totals and trends come out of one query. FIX: change compares with the previous calendar
+    # month (a unique-index lookup), so the first month of the range and months after a gap
+    # are not compared with whatever month last had data; null when that month has no entry.
+    previous = db.aliased(FinancialEntry)
+    is_income = FinancialEntry.category == 'income'
+    income = func.sum(case((is_income, FinancialEntry.amount), else_=0.0)).over(partition_by=FinancialEntry.month_year)
+    expenses = func.sum(case((is_income, 0.0), else_=FinancialEntry.amount)).over(partition_by=FinancialEntry.month_year)
+    rows = db.session.query(
+        FinancialEntry.month_year, FinancialEntry.category, FinancialEntry.amount,
+        FinancialEntry.amount - previous.amount, income, expenses
+    ).outerjoin(previous, db.and_(
+        previous.user_id == FinancialEntry.user_id,
+        previous.category == FinancialEntry.category,
+        previous.month_year == func.strftime('%Y-%m', func.date(FinancialEntry.month_year + '-01', '-1 month'))
+    )).filter(
+        FinancialEntry.user_id == user_id,
+        FinancialEntry.month_year >= months[0],
+        FinancialEntry.month_year <= months[-1]
+    ).order_by(FinancialEntry.month_year, FinancialEntry.category).all()
+
+    by_month = {month: {'month_year': month, 'income': 0, 'expenses': 0, 'net': 0, 'categories': []} for month in months}
+    for month_year, category, amount, delta, month_income, month_expenses in rows:
+        by_month[month_year].update(income=month_income, expenses=month_expenses, net=round(month_income - month_expenses, 2))
+        by_month[month_year]['categories'].append({'category': category, 'amount': amount, 'change': delta})
+    payload = {'from': months[0], 'to': months[-1], 'months': list(by_month.values())}
+
+    if len(_finance_history_cache) > 10000:
+        _finance_history_cache.clear()
+    _finance_history_cache[cache_key] = (version, payload)
+    return jsonify(payload)
 
 
 # --- ACADEMIC (COURSE) ENDPOINTS ---
 
+@app.route('/api/courses/catalog', methods=['GET'])
+@login_required
+def course_catalog():
+    """Catalog lookup for course pickers: ?q=<title prefix>&limit=N."""
+    prefix = normalize_course_title(request.args.get('q', ''))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    query = CourseCatalog.query
+    if prefix:
+        # Range scan on the unique normalized-title index
+        query = query.filter(*prefix_range(CourseCatalog.normalized, prefix))
+    return jsonify([c.to_dict() for c in query.order_by(CourseCatalog.normalized).limit(limit)])
+
 @app.route('/api/courses', methods=['GET', 'POST', 'DELETE'])
 @login_required
 def manage_courses():
@@ -819,16 +2562,28 @@ def manage_courses():
     
     if request.method == 'POST':
         title = data.get('title')
-        score = data.get('score', 0)
-        credits = data.get('credits', 3.0)
+        # FIX: JSON may carry numbers as strings ("85"); coerce before they reach the GPA maths.
+        # Course.score is an Integer column, so 88.5 is refused rather than stored as a REAL.
+        try:
+            score = float(data.get('score') or 0)
+            credits = float(data.get('credits', 3.0))
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Score and credits must be numbers.'}), 400
+        if not score.is_integer():
+            return jsonify({'message': 'Score must be a whole number.'}), 400
+        score = int(score)
         
-        if not title or credits <= 0:
-            return jsonify({'message': 'Course title and valid credits are required.'}), 400
+        if not title or not math.isfinite(credits) or credits <= 0 or not 0 <= score <= 100:
+            return jsonify({'message': 'Course title, a score from 0 to 100 and valid credits are required.'}), 400
         
-        new_course = Course(user_id=user_id, title=title, score=score, credits=credits)
+        try:
+            new_course = Course(user_id=user_id, title=title, score=score, credits=credits)
+        except ValueError:
+            return jsonify({'message': 'Course title, a score from 0 to 100 and valid credits are required.'}), 400
         db.session.add(new_course)
+        apply_course_to_gpa(user_id, score, credits)
         db.session.commit()
-        calculate_gpa(user_id)
+        invalidate_dashboard(user_id)
         return jsonify({'success': True, 'message': 'Course added.'}), 201
 
     if request.method == 'DELETE':
@@ -838,9 +2593,10 @@ def manage_courses():
         if not course:
             return jsonify({'message': 'Course not found or unauthorized'}), 404
             
+        apply_course_to_gpa(user_id, course.score, course.credits, sign=-1)
         db.session.delete(course)
         db.session.commit()
-        calculate_gpa(user_id)
+        invalidate_dashboard(user_id)
         return jsonify({'success': True, 'message': 'Course deleted.'}), 200
         
     # NOTE: PUT method for course update is not implemented as the current front-end only uses POST/DELETE/GET.
@@ -852,8 +2608,28 @@ def manage_courses():
 def community_posts():
     user_id = session['user_id']
     if request.method == 'GET':
-        posts = CommunityPost.query.order_by(CommunityPost.timestamp.desc()).all()
-        return jsonify([p.to_dict() for p in posts])
+        # Keyset pagination: ?limit=N&before=<cursor>, where the cursor comes from the
+        # X-Next-Cursor header of the previous page ("<timestamp>|<id>" of its last post)
+        limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+        query = db.session.query(CommunityPost, User.username).join(User, CommunityPost.user_id == User.id)
+
+        before = request.args.get('before')
+        if before:
+            try:
+                before_ts, before_id = before.rsplit('|', 1)
+                before_key = (datetime.fromisoformat(before_ts), int(before_id))
+            except ValueError:
+                return jsonify({'message': 'Invalid cursor'}), 400
+            query = query.filter(db.tuple_(CommunityPost.timestamp, CommunityPost.id) < before_key)
+
+        rows = query.order_by(CommunityPost.timestamp.desc(), CommunityPost.id.desc()).limit(limit + 1).all()
+        page = rows[:limit]
+
+        response = jsonify([post.to_dict(username) for post, username in page])
+        if len(rows) > limit:
+            last_post = page[-1][0]
+            response.headers['X-Next-Cursor'] = f'{last_post.timestamp.isoformat()}|{last_post.id}'
+        return response
     
     if request.method == 'POST':
         data = request.get_json()
@@ -887,15 +2663,132 @@ def post_comments(post_id):
             
         new_comment = CommunityComment(post_id=post_id, user_id=user_id, content=content)
         db.session.add(new_comment)
+        bump_comment_count(post_id)
         db.session.commit()
         return jsonify({'success': True, 'comment': new_comment.to_dict()}), 201
 
+# FTS5 highlight markers; swapped for <mark> after the snippet text is HTML-escaped
+HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE = '\x02', '\x03'
+
+COMMUNITY_SEARCH_SQL = db.text('''
+    SELECT 'post' AS kind, p.id AS post_id, NULL AS comment_id, u.username, p.timestamp,
+           highlight(community_post_fts, 0, :open, :close) AS title,
+           snippet(community_post_fts, 1, :open, :close, '…', 16) AS snippet,
+           bm25(community_post_fts, 5.0, 1.0) AS rank
+    FROM community_post_fts
+    JOIN community_post p ON p.id = community_post_fts.rowid
+    JOIN user u ON u.id = p.user_id
+    WHERE community_post_fts MATCH :query
+    UNION ALL
+    SELECT 'comment' AS kind, c.post_id, c.id AS comment_id, u.username, c.timestamp,
+           p.title AS title,
+           snippet(community_comment_fts, 0, :open, :close, '…', 16) AS snippet,
+           bm25(community_comment_fts) AS rank
+    FROM community_comment_fts
+    JOIN community_comment c ON c.id = community_comment_fts.rowid
+    JOIN community_post p ON p.id = c.post_id
+    JOIN user u ON u.id = c.user_id
+    WHERE community_comment_fts MATCH :query
+    ORDER BY rank
+    LIMIT :limit OFFSET :offset
+''')
+
+def fts_query(text):
+    """Turns free text into a safe FTS5 query: every word must match, the last one as a prefix."""
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+def highlight_html(text):
+    return str(escape(text or '')).replace(HIGHLIGHT_OPEN, '<mark>').replace(HIGHLIGHT_CLOSE, '</mark>')
+
+@app.route('/api/community/search', methods=['GET'])
+@login_required
+def community_search():
+    """Ranked full-text search over posts and comments (?q=...&limit=&offset=)."""
+    query = fts_query(request.args.get('q', ''))
+    if not query:
+        return jsonify({'message': 'Search query is required'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    rows = db.session.execute(COMMUNITY_SEARCH_SQL, {
+        'query': query, 'open': HIGHLIGHT_OPEN, 'close': HIGHLIGHT_CLOSE,
+        'limit': limit + 1, 'offset': offset
+    }).mappings().all()
+
+    response = jsonify([{
+        'kind': row['kind'],
+        'post_id': row['post_id'],
+        'comment_id': row['comment_id'],
+        'username': row['username'],
+        'timestamp': datetime.fromisoformat(row['timestamp']).isoformat(),
+        'title_html': highlight_html(row['title']),
+        'snippet_html': highlight_html(row['snippet']),
+    } for row in rows[:limit]])
+    if len(rows) > limit:
+        response.headers['X-Next-Cursor'] = str(offset + limit)
+    return response
+
+# Short prefixes match most of the campus, so their pages are cached briefly and shared
+DIRECTORY_CACHE_TTL = 30
+DIRECTORY_CACHE_MAX_PREFIX = 1
+_directory_cache = {} # (prefix, after, limit) -> (rows, expires_at)
+_directory_lock = threading.Lock()
+
+def directory_page(prefix, after, limit):
+    """Returns up to limit (id, username, sort_key) rows whose username_key starts with prefix."""
+    cache_key = (prefix, after, limit)
+    cacheable = len(prefix) <= DIRECTORY_CACHE_MAX_PREFIX
+    if cacheable:
+        with _directory_lock:
+            cached = _directory_cache.get(cache_key)
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+
+    sort_key = User.username_key
+    query = db.session.query(User.id, User.username, sort_key)
+    if prefix:
+        query = query.filter(*prefix_range(sort_key, prefix))
+    if after:
+        query = query.filter(db.tuple_(sort_key, User.id) > after)
+    rows = [tuple(row) for row in query.order_by(sort_key, User.id).limit(limit).all()]
+
+    if cacheable:
+        with _directory_lock:
+            if len(_directory_cache) > 1000:
+                _directory_cache.clear()
+            _directory_cache[cache_key] = (rows, time.monotonic() + DIRECTORY_CACHE_TTL)
+    return rows
+
 @app.route('/api/community/users', methods=['GET'])
 @login_required
 def community_users():
+    """Type-ahead user directory: ?q=<username prefix>&limit=N, next page via X-Next-Cursor."""
+    user_id = session['user_id']
+    prefix = normalize_username(request.args.get('q', ''))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+
+    after = None
+    cursor = request.args.get('after')
+    if cursor:
+        try:
+            after_name, after_id = decode_cursor(cursor)
+            after = (str(after_name), int(after_id))
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Invalid cursor'}), 400
+
+    # Fetch one spare row for the caller (filtered out below) and one to detect a next page
+    rows = directory_page(prefix, after, limit + 2)
+    others = [row for row in rows if row[0] != user_id]
+    page = others[:limit]
+
     # Only return users who are not the currently logged-in user
-    users = User.query.filter(User.id != session['user_id']).all()
-    return jsonify([{'id': u.id, 'username': u.username} for u in users])
+    response = jsonify([{'id': row[0], 'username': row[1]} for row in page])
+    if len(others) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(page[-1][2], page[-1][0])
+    return response
 
 @app.route('/api/community/chat/<int:target_id>', methods=['GET', 'POST'])
 @login_required
@@ -904,12 +2797,26 @@ def direct_chat(target_id):
     
     if request.method == 'GET':
         # Fetch messages between the current user and the target user
-        messages = DirectMessage.query.filter(
+        query = DirectMessage.query.filter(
             (DirectMessage.sender_id == user_id) & (DirectMessage.receiver_id == target_id) |
             (DirectMessage.sender_id == target_id) & (DirectMessage.receiver_id == user_id)
-        ).order_by(DirectMessage.timestamp.asc()).limit(50).all()
-        
-        return jsonify([m.to_dict() for m in messages])
+        )
+
+        # ?after_id=N returns only what arrived since the client's last message
+        after_id = request.args.get('after_id', type=int)
+        if after_id is not None:
+            messages = query.filter(DirectMessage.id > after_id).order_by(DirectMessage.id.asc()).limit(50).all()
+        else:
+            # Latest 50, returned oldest first
+            messages = query.order_by(DirectMessage.id.desc()).limit(50).all()[::-1]
+
+        # Seeing the peer's messages moves this user's read cursor for the conversation
+        newest_incoming = max((m.id for m in messages if m.sender_id == target_id), default=None)
+        messages_list = [m.to_dict() for m in messages]
+        if newest_incoming:
+            mark_conversation_read(user_id, target_id, newest_incoming)
+
+        return jsonify(messages_list)
         
     if request.method == 'POST':
         data = request.get_json()
@@ -927,21 +2834,371 @@ def direct_chat(target_id):
         )
         db.session.add(new_message)
         db.session.commit()
-        return jsonify({'success': True, 'message': new_message.to_dict()}), 201
+
+        message_dict = new_message.to_dict()
+        event_broker.publish(target_id, 'message', message_dict)
+        if target_id != user_id:
+            event_broker.publish(user_id, 'message', message_dict) # Sender's other open windows
+        return jsonify({'success': True, 'message': message_dict}), 201
+
+# FIX: Messages pushed over the SSE stream never pass through the GET above, so the
+# open chat acknowledges them here to move its read cursor.
+@app.route('/api/community/chat/<int:target_id>/read', methods=['POST'])
+@login_required
+def mark_direct_chat_read(target_id):
+    """Marks the conversation with target_id read up to {"up_to_id": N}."""
+    data = request.get_json() or {}
+    try:
+        up_to_id = int(data.get('up_to_id'))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'up_to_id must be an integer'}), 400
+    mark_conversation_read(session['user_id'], target_id, up_to_id)
+    return jsonify({'success': True})
+
+@app.route('/api/community/conversations', methods=['GET'])
+@login_required
+def community_conversations():
+    """Inbox: one entry per peer with the last message and unread count, newest first."""
+    user_id = session['user_id']
+    limit = max(1, min(request.args.get('limit', 50, type=int), 100))
+
+    query = db.session.query(ConversationSummary, User.username, DirectMessage).join(
+        User, User.id == ConversationSummary.peer_id
+    ).join(
+        DirectMessage, DirectMessage.id == ConversationSummary.last_message_id
+    ).filter(ConversationSummary.user_id == user_id)
+
+    # Same keyset cursor scheme as the community feed: "<last_message_at>|<peer_id>"
+    before = request.args.get('before')
+    if before:
+        try:
+            before_ts, before_peer = before.rsplit('|', 1)
+            before_key = (datetime.fromisoformat(before_ts), int(before_peer))
+        except ValueError:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        query = query.filter(db.tuple_(ConversationSummary.last_message_at, ConversationSummary.peer_id) < before_key)
+
+    rows = query.order_by(ConversationSummary.last_message_at.desc(), ConversationSummary.peer_id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+
+    conversations = []
+    for summary, peer_username, last_message in page:
+        sender_username = peer_username if last_message.sender_id == summary.peer_id else session.get('username')
+        conversations.append({
+            'peer_id': summary.peer_id,
+            'peer_username': peer_username,
+            'last_message': last_message.to_dict(sender_username),
+            'last_message_at': summary.last_message_at.isoformat(),
+            'unread_count': summary.unread_count,
+        })
+
+    response = jsonify(conversations)
+    if len(rows) > limit:
+        last = page[-1][0]
+        response.headers['X-Next-Cursor'] = f'{last.last_message_at.isoformat()}|{last.peer_id}'
+    return response
+
+@app.route('/api/community/chat/stream', methods=['GET'])
+@login_required
+def direct_chat_stream():
+    """Server-Sent Events channel pushing new direct messages to and from the user."""
+    return sse_response(session['user_id'], ['message'])
+
+# --- DELTA SYNC ENDPOINT ---
+
+@app.route('/api/sync', methods=['GET'])
+@login_required
+def delta_sync():
+    """Returns the rows changed and deleted since the client's cursor (?since=<cursor>)."""
+    user_id = session['user_id']
+    since = request.args.get('since', 0, type=int)
+
+    state = db.session.get(SyncState, user_id)
+    cursor = state.version if state else 0
+
+    changes = {name: [] for name in SYNC_MODELS}
+    deleted = {name: [] for name in SYNC_MODELS}
+
+    # Idle clients stop here after a single primary-key lookup. since=0 is a full fetch,
+    # which also covers rows that predate change tracking (version 0).
+    if since <= 0 or since < cursor:
+        for name, model in SYNC_MODELS.items():
+            query = model.query.filter(model.user_id == user_id)
+            if since > 0:
+                query = query.filter(model.version > since)
+            changes[name] = [row.to_dict() for row in query.order_by(model.version).all()]
+
+        # A fresh client (since=0) has nothing to delete locally
+        if since > 0:
+            tombstones = SyncTombstone.query.filter(
+                SyncTombstone.user_id == user_id,
+                SyncTombstone.version > since
+            ).order_by(SyncTombstone.version).all()
+            for tombstone in tombstones:
+                deleted[tombstone.table_name].append(tombstone.row_id)
+
+    return jsonify({'cursor': cursor, 'changes': changes, 'deleted': deleted})
+
+# --- CALENDAR EXPORT ---
+ICS_DAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+ICS_ANCHOR_MONDAY = date(2024, 1, 1) # first occurrence week for timetable rows with no updated_at
+
+def calendar_serializer():
+    # Tokens carry [user_id, token_secret]; replacing the secret revokes every older URL
+    return URLSafeSerializer(app.config['SECRET_KEY'], salt='calendar-feed')
+
+def calendar_feed_state(user_id):
+    """(version, token_secret) of the user's feed with one primary-key lookup."""
+    return tuple(db.session.query(CalendarFeed.version, CalendarFeed.token_secret).filter_by(user_id=user_id).first() or (0, None))
+
+def ics_text(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ics_line(line):
+    """Folds a content line at 75 octets as RFC 5545 requires."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    while encoded:
+        size = 75 if not parts else 74
+        while size < len(encoded) and (encoded[size] & 0xC0) == 0x80:
+            size -= 1 # never split a UTF-8 sequence
+        parts.append(encoded[:size].decode('utf-8'))
+        encoded = encoded[size:]
+    return '\r\n '.join(parts) + '\r\n'
+
+def ics_utc(value):
+    return as_utc(value).strftime('%Y%m%dT%H%M%SZ')
+
+def ics_event(uid, stamp, summary, start, extra=(), location=None, description=None):
+    lines = ['BEGIN:VEVENT', f'UID:{uid}@unisphere', f'DTSTAMP:{stamp}', f'DTSTART{start}', *extra,
+             f'SUMMARY:{ics_text(summary)}']
+    if location:
+        lines.append(f'LOCATION:{ics_text(location)}')
+    if description:
+        lines.append(f'DESCRIPTION:{ics_text(description)}')
+    lines.append('END:VEVENT')
+    return ''.join(ics_line(line) for line in lines)
+
+def calendar_events(user_id):
+    """Yields the user's schedule as VEVENT blocks, reading each table in yield_per batches."""
+    fallback_stamp = ics_utc(datetime.combine(ICS_ANCHOR_MONDAY, datetime.min.time()))
+
+    entries = db.session.execute(db.select(TimetableEntry).where(
+        TimetableEntry.user_id == user_id, TimetableEntry.day_index.isnot(None)
+    ).order_by(TimetableEntry.id).execution_options(yield_per=200)).scalars()
+    for entry in entries:
+        # Weekly class: first occurrence in the week the row was last edited, then RRULE (floating local time)
+        week = as_utc(entry.updated_at).date() if entry.updated_at else ICS_ANCHOR_MONDAY
+        first = week - timedelta(days=week.weekday()) + timedelta(days=entry.day_index)
+        start = datetime.combine(first, datetime.min.time()) + timedelta(minutes=entry.start_minute)
+        end = datetime.combine(first, datetime.min.time()) + timedelta(minutes=entry.end_minute)
+        yield ics_event(f'timetable-{entry.id}', ics_utc(entry.updated_at) if entry.updated_at else fallback_stamp,
+                        entry.course_title, f":{start.strftime('%Y%m%dT%H%M%S')}",
+                        [f"DTEND:{end.strftime('%Y%m%dT%H%M%S')}", f'RRULE:FREQ=WEEKLY;BYDAY={ICS_DAYS[entry.day_index]}'],
+                        location=entry.location)
+
+    tests = db.session.execute(db.select(Test).where(Test.user_id == user_id)
+                               .order_by(Test.id).execution_options(yield_per=200)).scalars()
+    for test in tests:
+        yield ics_event(f'test-{test.id}', ics_utc(test.updated_at or test.due_date),
+                        f'{test.course_title} {test.type}', f':{ics_utc(test.due_date)}', ['DURATION:PT30M'],
+                        description=test.details)
+
+    appointments = db.session.execute(db.select(Appointment).where(Appointment.user_id == user_id)
+                                      .order_by(Appointment.id).execution_options(yield_per=200)).scalars()
+    for appointment in appointments:
+        yield ics_event(f'appointment-{appointment.id}', ics_utc(appointment.updated_at or appointment.date_time),
+                        f'{appointment.type} appointment', f':{ics_utc(appointment.date_time)}', ['DURATION:PT1H'],
+                        description=appointment.details)
+
+@app.route('/api/calendar/feed-url', methods=['GET', 'POST'])
+@login_required
+def calendar_feed_url():
+    """Subscribable calendar URL; the signed token stands in for the session cookie calendar apps lack.
+
+    POST issues a new URL and revokes every URL handed out before it.
+    """
+    user_id = session['user_id']
+    secret = calendar_feed_state(user_id)[1]
+    if request.method == 'POST' or secret is None:
+        new_secret = secrets.token_urlsafe(32)
+        # A GET keeps a secret another request stored first; a POST always replaces it
+        replacement = new_secret if request.method == 'POST' else func.coalesce(CalendarFeed.token_secret, new_secret)
+        db.session.execute(sqlite_insert(CalendarFeed).values(user_id=user_id, version=0, token_secret=new_secret).on_conflict_do_update(
+            index_elements=[CalendarFeed.user_id], set_={'token_secret': replacement}
+        ))
+        db.session.commit()
+        secret = calendar_feed_state(user_id)[1]
+    token = calendar_serializer().dumps([user_id, secret])
+    return jsonify({'url': url_for('calendar_feed', token=token, _external=True)})
+
+@app.route('/api/calendar.ics', methods=['GET'])
+def calendar_feed():
+    """iCalendar feed of timetable (weekly), tests and appointments; authenticated by session or ?token=."""
+    token = request.args.get('token')
+    token_secret = None
+    if token:
+        try:
+            user_id, token_secret = calendar_serializer().loads(token)
+        except (BadSignature, TypeError, ValueError):
+            return jsonify({'message': 'Invalid calendar token'}), 401
+    else:
+        user_id = session.get('user_id')
+    if not user_id or not principal_cache.get(user_id):
+        return jsonify({'message': 'Authentication required'}), 401
+
+    # FIX: One primary-key read both checks the token secret and gives the ETag version,
+    # which only timetable, test and appointment writes move
+    version, current_secret = calendar_feed_state(user_id)
+    if token and not (isinstance(token_secret, str) and current_secret
+                      and hmac.compare_digest(token_secret.encode(), current_secret.encode())):
+        return jsonify({'message': 'Calendar token was revoked'}), 401
+    etag = f'cal-{user_id}-{version}'
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    def generate():
+        yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//UNISPHERE//Schedule//EN\r\nCALSCALE:GREGORIAN\r\n'
+        yield ics_line('X-WR-CALNAME:UNISPHERE')
+        yield from calendar_events(user_id)
+        yield 'END:VCALENDAR\r\n'
+
+    response = app.response_class(stream_with_context(generate()), mimetype='text/calendar')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Content-Disposition'] = 'inline; filename="unisphere.ics"'
+    return response
 
 # --- ADMIN PANEL ENDPOINTS ---
 
+# ?sort= key -> (keyset column, cursor value parser)
+ADMIN_USER_SORTS = {
+    'id': (User.id, int),
+    'username': (User.username_key, str),
+    'gpa': (User.gpa, float),
+}
+ADMIN_USER_COLUMNS = (User.id, User.username, User.is_admin, User.gpa)
+
+def admin_user_filters(args):
+    """SQL conditions for ?is_admin=, ?gpa_min=, ?gpa_max= and ?q= (username prefix); ValueError on bad input."""
+    conditions = []
+    if args.get('is_admin'):
+        conditions.append(User.is_admin == (args['is_admin'].lower() in ('1', 'true', 'yes')))
+    if args.get('gpa_min'):
+        conditions.append(User.gpa >= float(args['gpa_min']))
+    if args.get('gpa_max'):
+        conditions.append(User.gpa <= float(args['gpa_max']))
+    prefix = normalize_username(args.get('q', ''))
+    if prefix:
+        conditions += prefix_range(User.username_key, prefix)
+    return conditions
+
+def admin_user_dict(row):
+    return {'id': row.id, 'username': row.username, 'is_admin': row.is_admin, 'gpa': row.gpa}
+
 @app.route('/api/admin/users', methods=['GET'])
 @admin_required
 def get_all_users():
-    users = User.query.all()
-    user_list = [{
-        'id': u.id,
-        'username': u.username,
-        'is_admin': u.is_admin,
-        'gpa': u.gpa
-    } for u in users]
-    return jsonify(user_list)
+    """One page of users; ?sort=id|username|gpa&order=asc|desc&limit=N&after=<X-Next-Cursor> plus filters."""
+    sort = request.args.get('sort', 'id')
+    if sort not in ADMIN_USER_SORTS:
+        return jsonify({'message': f"Unknown sort '{sort}'"}), 400
+    sort_column, parse_key = ADMIN_USER_SORTS[sort]
+    descending = request.args.get('order', 'asc') == 'desc'
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    try:
+        conditions = admin_user_filters(request.args)
+    except ValueError:
+        return jsonify({'message': 'gpa_min/gpa_max must be numbers'}), 400
+
+    cursor = request.args.get('after')
+    if cursor:
+        try:
+            key, last_id = decode_cursor(cursor)
+            after = (parse_key(key), int(last_id))
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Invalid cursor'}), 400
+        position = db.tuple_(sort_column, User.id)
+        conditions.append(position < after if descending else position > after)
+
+    ordering = [sort_column.desc(), User.id.desc()] if descending else [sort_column, User.id]
+    rows = db.session.query(*ADMIN_USER_COLUMNS, sort_column.label('sort_key')).filter(*conditions).order_by(*ordering).limit(limit + 1).all()
+    page = rows[:limit]
+
+    response = jsonify([admin_user_dict(row) for row in page])
+    if len(rows) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(page[-1].sort_key, page[-1].id)
+    return response
+
+@app.route('/api/admin/users/export', methods=['GET'])
+@admin_required
+def export_users():
+    """Streams every matching user as ?format=csv (default) or ndjson, in id order and constant memory."""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'message': 'format must be csv or ndjson'}), 400
+    try:
+        conditions = admin_user_filters(request.args)
+    except ValueError:
+        return jsonify({'message': 'gpa_min/gpa_max must be numbers'}), 400
+    stmt = db.select(*ADMIN_USER_COLUMNS).where(*conditions).order_by(User.id).execution_options(yield_per=1000)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(['id', 'username', 'is_admin', 'gpa'])
+        for partition in db.session.execute(stmt).partitions():
+            # One chunk per fetched batch keeps both memory and write calls bounded
+            for row in partition:
+                if export_format == 'csv':
+                    writer.writerow([row.id, row.username, int(bool(row.is_admin)), row.gpa])
+                else:
+                    buffer.write(json.dumps(admin_user_dict(row)) + '\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="users.{export_format}"'
+    return response
+
+@app.route('/api/admin/principal_cache', methods=['GET'])
+@admin_required
+def principal_cache_stats():
+    """Exposes the auth principal cache hit/miss counters."""
+    return jsonify(principal_cache.stats())
+
+@app.route('/api/admin/broadcasts', methods=['GET', 'POST'])
+@admin_required
+def admin_broadcasts():
+    """Publishes an announcement to every user with a single insert."""
+    if request.method == 'GET':
+        broadcasts = Broadcast.query.order_by(Broadcast.id.desc()).limit(50).all()
+        return jsonify([b.to_dict() for b in broadcasts])
+
+    data = request.get_json() or {}
+    message = (data.get('message') or '').strip()
+    if not message or len(message) > 255:
+        return jsonify({'message': 'Message is required (max 255 characters)'}), 400
+
+    broadcast = Broadcast(message=message, created_by=session['user_id'])
+    db.session.add(broadcast)
+    db.session.commit()
+
+    # Only in-memory state is touched per user: loaded counters, cached dashboards, open streams
+    unread_counter.adjust_all(1)
+    invalidate_all_dashboards()
+    payload = broadcast.to_dict()
+    for user_id in event_broker.subscribed_users():
+        publish_notification_event(user_id, payload)
+    return jsonify({'success': True, 'broadcast': payload}), 201
 
 @app.route('/api/admin/user/<int:user_id>', methods=['DELETE', 'PUT'])
 @admin_required
@@ -952,49 +3209,94 @@ def manage_user(user_id):
             return jsonify({'message': 'User not found'}), 404
         
         if request.method == 'DELETE':
-            session_obj.delete(user)
-            session_obj.commit()
-            return jsonify({'success': True, 'message': f'User {user_id} deleted'}), 200
+            if user_id == session['user_id']:
+                return jsonify({'message': 'You cannot delete your own account'}), 400
+            # Removes the user's rows from every dependent table in one transaction
+            result = purge_users([user_id])
+            return jsonify({'success': True, 'message': f'User {user_id} deleted', 'deleted': result['rows']}), 200
             
         elif request.method == 'PUT':
-            data = request.get_json()
-            # Only allow GPA and is_admin modification
+            data = request.get_json() or {}
+            # FIX: GPA is derived from the user's courses (see apply_course_to_gpa), so only is_admin is editable
             if 'gpa' in data:
-                user.gpa = data['gpa']
+                return jsonify({'message': "GPA is calculated from the user's courses and cannot be set"}), 400
             if 'is_admin' in data:
+                if not isinstance(data['is_admin'], bool):
+                    return jsonify({'message': 'is_admin must be true or false'}), 400
                 user.is_admin = data['is_admin']
             session_obj.commit()
+            principal_cache.invalidate(user_id)
+            invalidate_dashboard(user_id)
             return jsonify({'success': True, 'message': f'User {user_id} updated'}), 200
 
+def admin_schedule_filters(model):
+    """?user_id=, ?catalog_id= and ?course= (case-insensitive title prefix) conditions shared by the admin schedule views."""
+    conditions = []
+    user_id = request.args.get('user_id', type=int)
+    if user_id:
+        conditions.append(model.user_id == user_id)
+    catalog_id = request.args.get('catalog_id', type=int)
+    if catalog_id:
+        conditions.append(model.catalog_id == catalog_id)
+    prefix = normalize_course_title(request.args.get('course', ''))
+    if prefix:
+        # Same range scan over the catalog's unique key as /api/courses/catalog
+        conditions.append(model.catalog_id.in_(db.select(CourseCatalog.id).where(*prefix_range(CourseCatalog.normalized, prefix))))
+    return conditions
+
 @app.route('/api/admin/timetable', methods=['GET', 'POST', 'DELETE'])
 @admin_required
 def admin_manage_timetable():
     if request.method == 'GET':
-        # Fetch all timetable entries and the associated student username
-        timetable_data = db.session.query(TimetableEntry, User.username).join(User).order_by(asc(TimetableEntry.day_of_week), asc(TimetableEntry.start_time)).all()
-        entries_list = []
-        for entry, username in timetable_data:
-            e_dict = entry.to_dict()
-            e_dict['username'] = username
-            entries_list.append(e_dict)
-        return jsonify(entries_list)
+        # One page of entries in week order: ?user_id=&course=<title prefix>&day=&limit=N&after=<X-Next-Cursor>
+        limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+        conditions = admin_schedule_filters(TimetableEntry)
+        if request.args.get('day'):
+            # FIX: Filter on the indexed day_index rather than the day_of_week text
+            try:
+                conditions.append(TimetableEntry.day_index == DAYS_OF_WEEK.index(request.args['day'].strip().capitalize()))
+            except ValueError:
+                return jsonify({'message': 'Unknown day'}), 400
+        week_order = (TimetableEntry.day_index, TimetableEntry.start_minute, TimetableEntry.id)
+        cursor = request.args.get('after')
+        if cursor:
+            try:
+                day_index, start_minute, entry_id = decode_cursor(cursor)
+                after = (
+                    None if day_index is None else int(day_index),
+                    None if start_minute is None else int(start_minute),
+                    int(entry_id),
+                )
+            except (TypeError, ValueError):
+                return jsonify({'message': 'Invalid cursor'}), 400
+            conditions.append(keyset_after(week_order, after))
+
+        # Plain column rows: no ORM objects are built for the page
+        rows = db.session.query(
+            TimetableEntry.id, TimetableEntry.user_id, User.username, TimetableEntry.catalog_id, CourseCatalog.title.label('course_title'), TimetableEntry.day_of_week,
+            TimetableEntry.start_time, TimetableEntry.end_time, TimetableEntry.location, TimetableEntry.day_index, TimetableEntry.start_minute
+        ).join(User, User.id == TimetableEntry.user_id).outerjoin(CourseCatalog, CourseCatalog.id == TimetableEntry.catalog_id).filter(*conditions).order_by(
+            *[column.nulls_first() for column in week_order] # legacy rows without day/minute come first
+        ).limit(limit + 1).all()
+        page = rows[:limit]
+
+        response = jsonify([{
+            'id': row.id, 'user_id': row.user_id, 'username': row.username, 'catalog_id': row.catalog_id, 'course_title': row.course_title,
+            'day_of_week': row.day_of_week, 'start_time': row.start_time, 'end_time': row.end_time, 'location': row.location
+        } for row in page])
+        if len(rows) > limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(page[-1].day_index, page[-1].start_minute, page[-1].id)
+        return response
 
     data = request.get_json()
     
     if request.method == 'POST':
-        user_id = data.get('user_id')
-        course_title = data.get('course_title')
-        day_of_week = data.get('day_of_week')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
-        location = data.get('location')
-        
-        if not all([user_id, course_title, day_of_week, start_time, end_time]):
-            return jsonify({'message': 'Missing required fields'}), 400
-            
-        new_entry = TimetableEntry(user_id=user_id, course_title=course_title, day_of_week=day_of_week, start_time=start_time, end_time=end_time, location=location)
+        new_entry, error = build_timetable_entry(data.get('user_id'), data)
+        if error:
+            return error
         db.session.add(new_entry)
         db.session.commit()
+        invalidate_dashboard(new_entry.user_id)
         return jsonify({'success': True, 'message': 'Timetable entry added.'}), 201
 
     if request.method == 'DELETE':
@@ -1002,22 +3304,47 @@ def admin_manage_timetable():
         with Session(db.engine) as session_obj:
             entry = session_obj.get(TimetableEntry, entry_id)
             if not entry: return jsonify({'message': 'Entry not found'}), 404
+            owner_id = entry.user_id
             session_obj.delete(entry)
             session_obj.commit()
+            invalidate_dashboard(owner_id)
             return jsonify({'success': True, 'message': 'Timetable entry deleted.'}), 200
 
 @app.route('/api/admin/tests', methods=['GET', 'POST', 'DELETE'])
 @admin_required
 def admin_manage_tests():
     if request.method == 'GET':
-        # Fetch all tests and the associated student username
-        tests_data = db.session.query(Test, User.username).join(User).order_by(asc(Test.due_date)).all()
-        tests_list = []
-        for test, username in tests_data:
-            t_dict = test.to_dict()
-            t_dict['username'] = username
-            tests_list.append(t_dict)
-        return jsonify(tests_list)
+        # One page of tests by due date: ?user_id=&course=<title prefix>&from=&to=<ISO dates>&limit=N&after=<X-Next-Cursor>
+        limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+        conditions = admin_schedule_filters(Test)
+        try:
+            if request.args.get('from'):
+                conditions.append(Test.due_date >= datetime.fromisoformat(request.args['from']))
+            if request.args.get('to'):
+                conditions.append(Test.due_date < datetime.fromisoformat(request.args['to']))
+        except ValueError:
+            return jsonify({'message': 'from/to must be ISO dates'}), 400
+        cursor = request.args.get('after')
+        if cursor:
+            try:
+                due_ts, test_id = decode_cursor(cursor)
+                after_key = (datetime.fromisoformat(due_ts), int(test_id))
+            except (TypeError, ValueError):
+                return jsonify({'message': 'Invalid cursor'}), 400
+            conditions.append(db.tuple_(Test.due_date, Test.id) > after_key)
+
+        rows = db.session.query(
+            Test.id, Test.user_id, User.username, Test.catalog_id, CourseCatalog.title.label('course_title'), Test.type, Test.due_date, Test.details
+        ).join(User, User.id == Test.user_id).outerjoin(CourseCatalog, CourseCatalog.id == Test.catalog_id).filter(*conditions).order_by(Test.due_date, Test.id).limit(limit + 1).all()
+        page = rows[:limit]
+
+        response = jsonify([{
+            'id': row.id, 'user_id': row.user_id, 'username': row.username, 'catalog_id': row.catalog_id, 'course_title': row.course_title,
+            'type': row.type, 'due_date': row.due_date.isoformat(), 'details': row.details
+        } for row in page])
+        if len(rows) > limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(page[-1].due_date.isoformat(), page[-1].id)
+        return response
 
     data = request.get_json()
     
@@ -1037,9 +3364,13 @@ def admin_manage_tests():
         except ValueError:
             return jsonify({'message': 'Invalid date format'}), 400
 
-        new_test = Test(user_id=user_id, course_title=course_title, type=type, due_date=due_date, details=details)
+        try:
+            new_test = Test(user_id=user_id, course_title=course_title, type=type, due_date=due_date, details=details)
+        except ValueError:
+            return jsonify({'message': 'Invalid course_title'}), 400
         db.session.add(new_test)
         db.session.commit()
+        invalidate_dashboard(new_test.user_id)
         return jsonify({'success': True, 'message': 'Test added.'}), 201
 
     if request.method == 'DELETE':
@@ -1047,10 +3378,408 @@ def admin_manage_tests():
         with Session(db.engine) as session_obj:
             test = session_obj.get(Test, test_id)
             if not test: return jsonify({'message': 'Test not found'}), 404
+            owner_id = test.user_id
             session_obj.delete(test)
             session_obj.commit()
+            invalidate_dashboard(owner_id)
             return jsonify({'success': True, 'message': 'Test deleted.'}), 200
 
+def assign_course_test(catalog_id, test_type, due_date, details=None):
+    """Creates the test for every student with a Course row in the catalog course; returns rows created.
+
+    Two set-based statements in one transaction: bump the enrolled students' sync
+    versions, then INSERT ... SELECT the tests. Students who already have this
+    exact test (same course, type and due date) are skipped, so retries are safe.
+    """
+    already_assigned = db.select(Test.id).where(
+        Test.user_id == Course.user_id, Test.catalog_id == catalog_id,
+        Test.type == test_type, Test.due_date == due_date
+    ).exists()
+    enrolled = (Course.catalog_id == catalog_id, ~already_assigned)
+
+    db.session.execute(sqlite_insert(SyncState).from_select(
+        ['user_id', 'version'], db.select(Course.user_id, db.literal(1)).where(*enrolled).distinct()
+    ).on_conflict_do_update(index_elements=[SyncState.user_id], set_={'version': SyncState.version + 1}))
+    db.session.execute(sqlite_insert(CalendarFeed).from_select(
+        ['user_id', 'version'], db.select(Course.user_id, db.literal(1)).where(*enrolled).distinct()
+    ).on_conflict_do_update(index_elements=[CalendarFeed.user_id], set_={'version': CalendarFeed.version + 1}))
+
+    student_version = db.select(SyncState.version).where(SyncState.user_id == Course.user_id).scalar_subquery()
+    created = db.session.execute(Test.__table__.insert().from_select(
+        ['user_id', 'catalog_id', 'type', 'due_date', 'details', 'version', 'updated_at'],
+        db.select(
+            Course.user_id, db.literal(catalog_id), db.literal(test_type),
+            db.literal(due_date, db.DateTime), db.literal(details), student_version,
+            db.literal(datetime.now(timezone.utc), db.DateTime)
+        ).where(*enrolled).distinct()
+    ).returning(Test.id, Test.user_id)).all()
+    # Core inserts skip collect_reminder_changes; tell another process's scheduler directly
+    if created:
+        bump_reminder_marker(db.session)
+    db.session.commit()
+
+    invalidate_dashboard(*{user_id for _, user_id in created})
+    for test_id, _ in created:
+        reminder_scheduler.schedule('test', test_id, due_date)
+    return len(created)
+
+# Background admin jobs: id -> status dict, kept for the life of the process
+_admin_jobs = {}
+
+def start_admin_job(description, target):
+    """Runs target(progress) in a thread with an app context; returns the job id for /api/admin/jobs/<id>.
+
+    target may call progress(**info) to publish its progress on the job.
+    """
+    job_id = uuid.uuid4().hex
+    _admin_jobs[job_id] = {'id': job_id, 'description': description, 'status': 'running', 'progress': None, 'result': None, 'error': None}
+
+    def progress(**info):
+        _admin_jobs[job_id]['progress'] = info
+
+    def run():
+        with app.app_context():
+            try:
+                _admin_jobs[job_id]['result'] = target(progress)
+                _admin_jobs[job_id]['status'] = 'done'
+            except Exception as error:
+                db.session.rollback()
+                app.logger.exception('Admin job %s failed', job_id)
+                _admin_jobs[job_id].update(status='failed', error=str(error))
+
+    threading.Thread(target=run, name=f'admin-job-{job_id[:8]}', daemon=True).start()
+    return job_id
+
+@app.route('/api/admin/jobs/<job_id>', methods=['GET'])
+@admin_required
+def admin_job_status(job_id):
+    job = _admin_jobs.get(job_id)
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/admin/tests/course', methods=['POST'])
+@admin_required
+def admin_assign_course_test():
+    """Assigns a test to every student taking a course: {catalog_id | course_title, type, due_date, details, background}."""
+    data = request.get_json() or {}
+    test_type = data.get('type')
+    due_date_str = data.get('due_date')
+    if not test_type or not due_date_str or not (data.get('catalog_id') or data.get('course_title')):
+        return jsonify({'message': 'catalog_id or course_title, type and due_date are required'}), 400
+    try:
+        due_date = datetime.fromisoformat(due_date_str.replace('Z', '')).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return jsonify({'message': 'Invalid date format'}), 400
+
+    if data.get('catalog_id'):
+        catalog = db.session.get(CourseCatalog, data['catalog_id'])
+    else:
+        catalog = CourseCatalog.query.filter_by(normalized=normalize_course_title(data['course_title'])).first()
+    if not catalog:
+        return jsonify({'message': 'Course not found in catalog'}), 404
+
+    args = (catalog.id, test_type, due_date, data.get('details'))
+    if data.get('background'):
+        job_id = start_admin_job(f'Assign {test_type} to {catalog.title}', lambda progress: assign_course_test(*args))
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    created = assign_course_test(*args)
+    return jsonify({'success': True, 'message': f'{test_type} assigned to {created} students.', 'created': created}), 201
+
+def check_course_catalog():
+    """Lists courses, timetable entries and tests that point at no catalog row, which a course-wide fan-out would miss.
+
+    SQLite doesn't enforce the catalog_id foreign key, and databases that ran migration 15
+    before it mapped blank legacy titles to the placeholder row were left with NULL catalog_ids.
+    """
+    problems = []
+    for model in CATALOG_MODELS:
+        orphans = db.session.query(model.id, model.catalog_id).outerjoin(CourseCatalog, CourseCatalog.id == model.catalog_id).filter(CourseCatalog.id.is_(None))
+        for row_id, catalog_id in orphans.yield_per(5000):
+            problems.append(f"{model.__tablename__} {row_id} points at missing catalog {catalog_id}")
+    return problems
+
+@app.cli.command('check-course-catalog')
+def check_course_catalog_command():
+    """Verifies every course, timetable entry and test points at a catalog row."""
+    problems = check_course_catalog()
+    for problem in problems[:100]:
+        print(f"  {problem}")
+    if problems:
+        raise click.ClickException(f"{len(problems)} course catalog problems found")
+    print("Course catalog is consistent.")
+
+# --- USER PURGE ---
+# (model, condition builder) in dependency order: rows that reference other user-owned rows go first
+USER_PURGE_STEPS = [
+    (ConversationSummary, lambda ids: db.or_(ConversationSummary.user_id.in_(ids), ConversationSummary.peer_id.in_(ids))),
+    (DirectMessage, lambda ids: db.or_(DirectMessage.sender_id.in_(ids), DirectMessage.receiver_id.in_(ids))),
+    (CommunityComment, lambda ids: db.or_(
+        CommunityComment.user_id.in_(ids),
+        CommunityComment.post_id.in_(db.select(CommunityPost.id).where(CommunityPost.user_id.in_(ids)))
+    )),
+    (CommunityPost, lambda ids: CommunityPost.user_id.in_(ids)),
+] + [
+    (model, lambda ids, model=model: model.user_id.in_(ids))
+    for model in [Course, Appointment, TimetableEntry, Test, Notification, FinancialEntry, StudySession, MoodEntry,
+                  HydrationEntry, HydrationDaily, BroadcastCursor, SyncTombstone, SyncState, CalendarFeed]
+]
+PURGE_CHUNK_SIZE = 500
+
+def purge_user_chunk(user_ids, deleted):
+    """Deletes the users and everything they own with set-based statements, in one transaction."""
+    conn = db.session.connection()
+    # Comments left on other people's posts are about to go; keep those posts' counters right
+    surviving_posts = db.select(CommunityComment.post_id).where(CommunityComment.user_id.in_(user_ids))
+    removed = db.select(func.count(CommunityComment.id)).where(
+        CommunityComment.post_id == CommunityPost.id, CommunityComment.user_id.in_(user_ids)
+    ).scalar_subquery()
+    conn.execute(CommunityPost.__table__.update().where(
+        CommunityPost.id.in_(surviving_posts), CommunityPost.user_id.not_in(user_ids)
+    ).values(comment_count=CommunityPost.comment_count - removed))
+
+    for model, condition in USER_PURGE_STEPS:
+        count = conn.execute(model.__table__.delete().where(condition(user_ids))).rowcount
+        deleted[model.__tablename__] = deleted.get(model.__tablename__, 0) + count
+    # Announcements stay; they just lose their author
+    conn.execute(Broadcast.__table__.update().where(Broadcast.created_by.in_(user_ids)).values(created_by=None))
+    count = conn.execute(User.__table__.delete().where(User.id.in_(user_ids))).rowcount
+    deleted['user'] = deleted.get('user', 0) + count
+    db.session.commit()
+
+    for user_id in user_ids:
+        principal_cache.invalidate(user_id)
+        unread_counter.forget(user_id)
+        _busy_bitmap_cache.pop(user_id, None)
+    invalidate_dashboard(*user_ids)
+    with _directory_lock:
+        _directory_cache.clear()
+
+def purge_users(user_ids, progress=None, chunk_size=PURGE_CHUNK_SIZE):
+    """Permanently removes users and all their data, chunk_size users per transaction."""
+    user_ids = sorted({int(user_id) for user_id in user_ids})
+    deleted = {}
+    for start in range(0, len(user_ids), chunk_size):
+        purge_user_chunk(user_ids[start:start + chunk_size], deleted)
+        if progress:
+            progress(users_done=min(start + chunk_size, len(user_ids)), users_total=len(user_ids))
+    return {'users': deleted.get('user', 0), 'rows': deleted}
+
+@app.route('/api/admin/users/purge', methods=['POST'])
+@admin_required
+def admin_purge_users():
+    """Bulk purge: {"user_ids": [...], "background": true} for e.g. graduated cohorts."""
+    data = request.get_json() or {}
+    # A string would iterate character by character ("34" -> users 3 and 4); accept only a real list of ints
+    raw_ids = data.get('user_ids')
+    if not isinstance(raw_ids, list) or not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in raw_ids):
+        return jsonify({'message': 'user_ids must be a list of integers'}), 400
+    user_ids = set(raw_ids)
+    if not user_ids:
+        return jsonify({'message': 'user_ids is required'}), 400
+    if session['user_id'] in user_ids:
+        return jsonify({'message': 'You cannot delete your own account'}), 400
+
+    if data.get('background'):
+        job_id = start_admin_job(f'Purge {len(user_ids)} users', lambda progress: purge_users(user_ids, progress))
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    return jsonify({'success': True, **purge_users(user_ids)}), 200
+
+@app.cli.command('purge-users')
+@click.argument('user_ids', nargs=-1, type=int, required=True)
+def purge_users_command(user_ids):
+    """Permanently deletes the given users and everything they own."""
+    result = purge_users(user_ids, progress=lambda users_done, users_total: print(f"  {users_done}/{users_total} users purged"))
+    print(f"Purged {result['users']} users:")
+    for table, count in sorted(result['rows'].items()):
+        print(f"  {table}: {count}")
+
+# --- BULK SCHEDULE IMPORT ---
+# CSV columns per import kind; every row also needs user_id or username
+IMPORT_COLUMNS = {
+    'timetable': ['course_title', 'day_of_week', 'start_time', 'end_time'],
+    'tests': ['course_title', 'type', 'due_date'],
+}
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_MAX_ERRORS = 1000
+
+def parse_import_row(kind, row):
+    """Turns a CSV row into insert values (minus user_id/sync columns); ValueError with a message if invalid."""
+    missing = [column for column in IMPORT_COLUMNS[kind] if not (row.get(column) or '').strip()]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if kind == 'timetable':
+        day = row['day_of_week'].strip().capitalize()
+        if day not in DAYS_OF_WEEK:
+            raise ValueError(f"unknown day_of_week '{row['day_of_week']}'")
+        try:
+            start_minute, end_minute = clock_to_minutes(row['start_time']), clock_to_minutes(row['end_time'])
+        except ValueError:
+            raise ValueError('times must be HH:MM')
+        if end_minute <= start_minute:
+            raise ValueError('end_time must be after start_time')
+        return {
+            'course_title': row['course_title'].strip()[:100], 'day_of_week': day,
+            'start_time': minutes_to_clock(start_minute), 'end_time': minutes_to_clock(end_minute),
+            'location': (row.get('location') or '').strip() or None,
+            'day_index': DAYS_OF_WEEK.index(day), 'start_minute': start_minute, 'end_minute': end_minute,
+        }
+    try:
+        due_date = datetime.fromisoformat(row['due_date'].strip().replace('Z', ''))
+    except ValueError:
+        raise ValueError(f"invalid due_date '{row['due_date']}'")
+    return {
+        'course_title': row['course_title'].strip()[:100], 'type': row['type'].strip()[:50],
+        'due_date': due_date, 'details': (row.get('details') or '').strip() or None,
+    }
+
+def import_chunk(kind, chunk, errors):
+    """Validates and inserts one chunk of (line, row) pairs in a single transaction; returns rows inserted."""
+    model = TimetableEntry if kind == 'timetable' else Test
+
+    # Resolve owners for the whole chunk with one query each for ids and usernames
+    ids = {int(row['user_id']) for _, row in chunk if (row.get('user_id') or '').strip().isdigit()}
+    names = {row['username'].strip() for _, row in chunk if (row.get('username') or '').strip()}
+    known_ids = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(ids))} if ids else set()
+    by_name = dict(db.session.query(User.username, User.id).filter(User.username.in_(names))) if names else {}
+
+    # Existing classes of the chunk's users, so overlaps are rejected like a single POST would
+    busy = {}
+    values = []
+    for line, row in chunk:
+        user_ref = (row.get('user_id') or '').strip()
+        user_id = int(user_ref) if user_ref.isdigit() and int(user_ref) in known_ids else by_name.get((row.get('username') or '').strip())
+        try:
+            if user_id is None:
+                raise ValueError('unknown user_id/username')
+            parsed = parse_import_row(kind, row)
+        except ValueError as error:
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({'line': line, 'message': str(error)})
+            continue
+        parsed['user_id'] = user_id
+        values.append((line, parsed))
+
+    if kind == 'timetable' and values:
+        owners = {parsed['user_id'] for _, parsed in values}
+        for user_id, day, start, end in db.session.query(
+            TimetableEntry.user_id, TimetableEntry.day_index, TimetableEntry.start_minute, TimetableEntry.end_minute
+        ).filter(TimetableEntry.user_id.in_(owners), TimetableEntry.day_index.isnot(None)):
+            busy.setdefault((user_id, day), []).append((start, end))
+        accepted = []
+        for line, parsed in values:
+            slots = busy.setdefault((parsed['user_id'], parsed['day_index']), [])
+            if any(start < parsed['end_minute'] and end > parsed['start_minute'] for start, end in slots):
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({'line': line, 'message': 'overlaps an existing class'})
+                continue
+            slots.append((parsed['start_minute'], parsed['end_minute']))
+            accepted.append((line, parsed))
+        values = accepted
+
+    if not values:
+        return 0
+
+    # Core executemany bypasses the flush hooks, so stamp sync versions and catalog ids here
+    now = datetime.now(timezone.utc)
+    conn = db.session.connection()
+    versions = bump_sync_versions(db.session, {parsed['user_id'] for _, parsed in values})
+    bump_calendar_versions(db.session, versions)
+    catalog = resolve_catalog_ids(db.session, {parsed['course_title'] for _, parsed in values})
+    rows = []
+    for _, parsed in values:
+        title = parsed.pop('course_title')
+        rows.append(dict(parsed, version=versions[parsed['user_id']], updated_at=now, catalog_id=catalog[normalize_course_title(title)]))
+    if kind == 'tests':
+        # New ids are needed to queue reminders
+        inserted = conn.execute(Test.__table__.insert().returning(Test.id, Test.due_date), rows).all()
+        bump_reminder_marker(db.session)
+    else:
+        conn.execute(model.__table__.insert(), rows)
+        inserted = []
+    db.session.commit()
+
+    # In-process caches and the scheduler are told directly; a server running beside the
+    # CLI sees the bumped SyncState versions and ReminderMarker.
+    invalidate_dashboard(*versions)
+    for test_id, due_date in inserted:
+        reminder_scheduler.schedule('test', test_id, due_date)
+    return len(rows)
+
+def import_schedule_csv(kind, text_stream, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Streams a CSV of timetable entries or tests into the database, chunk_size rows per transaction.
+
+    Invalid rows are skipped and reported by line number; valid rows of the same chunk still go in.
+    """
+    reader = csv.DictReader(text_stream)
+    header = set(reader.fieldnames or [])
+    missing = [column for column in IMPORT_COLUMNS[kind] if column not in header]
+    if not header & {'user_id', 'username'}:
+        missing.append('user_id or username')
+    if missing:
+        raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+
+    started = time.perf_counter()
+    imported = processed = 0
+    errors = []
+    chunk = []
+    for row in reader:
+        chunk.append((reader.line_num, row))
+        if len(chunk) >= chunk_size:
+            imported += import_chunk(kind, chunk, errors)
+            processed += len(chunk)
+            chunk = []
+            if progress:
+                progress(processed, imported)
+    if chunk:
+        imported += import_chunk(kind, chunk, errors)
+        processed += len(chunk)
+        if progress:
+            progress(processed, imported)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'processed': processed,
+        'imported': imported,
+        'failed': processed - imported,
+        'errors': errors, # first IMPORT_MAX_ERRORS only
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(processed / elapsed) if elapsed else processed,
+    }
+
+@app.route('/api/admin/import/<kind>', methods=['POST'])
+@admin_required
+def admin_import_schedule(kind):
+    """Bulk-loads timetable entries or tests from a CSV upload (multipart 'file') or a raw text/csv body."""
+    if kind not in IMPORT_COLUMNS:
+        return jsonify({'message': 'Import kind must be timetable or tests'}), 404
+    upload = request.files.get('file')
+    raw = upload.stream if upload else request.stream
+    try:
+        result = import_schedule_csv(kind, io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''),
+                                     progress=lambda processed, imported: app.logger.info(
+                                         'Import %s: %d rows processed, %d imported', kind, processed, imported))
+    except (ValueError, UnicodeDecodeError) as error:
+        db.session.rollback()
+        return jsonify({'message': str(error)}), 400
+    return jsonify(result), 200
+
+@app.cli.command('import-schedule')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_COLUMNS)))
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True, help='Rows per transaction.')
+def import_schedule_command(kind, csv_file, chunk_size):
+    """Bulk-loads a CSV of timetable entries or tests (with user_id or username columns)."""
+    try:
+        result = import_schedule_csv(kind, csv_file, chunk_size, progress=lambda processed, imported: print(
+            f"  {processed} rows processed, {imported} imported"))
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    for error in result['errors']:
+        print(f"  line {error['line']}: {error['message']}")
+    print(f"Imported {result['imported']} of {result['processed']} rows in {result['seconds']}s "
+          f"({result['rows_per_second']} rows/s).")
+
 # --- RUN THE APP ---
 
 if __name__ == '__main__':